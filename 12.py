@@ -18,24 +18,34 @@ Usage:
   export EMBEDDING_MODEL="text-embedding-3-small"
   python3 12_fixed.py --brief "Target SMB owners buying routers and labelers"
   python3 12_fixed.py --debug
+  python3 12_fixed.py --brief "..." --json   # one JSON document: rows + generation
 """
 
-import os, sys, json, argparse, re, time, traceback
+import os, sys, json, argparse, time, traceback, threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import List, Tuple, Optional, Dict, Any
+from typing import List, Tuple, Optional, Dict, Any, Iterator
 
 import numpy as np
 import faiss
-import httpx
-from packaging import version
-from openai import OpenAI, BadRequestError
+from openai import OpenAI
 
-from utils.embedding import get_embedding  # uses EMBEDDING_BACKEND
+from utils.embedding import get_embeddings_batch, model_fingerprint  # uses EMBEDDING_BACKEND
+from utils.openai_client import openai_client as _openai_client, has_japanese  # proxy-aware, shared with ingest
+from utils.translation_cache import get_cached, put_cached  # shared on-disk cache
+from utils.segment_store import SegmentStore, tokenize_lower  # columnar, mmapped segments
+from utils.projection import Projection, projection_path  # reduced-dim index (optional)
+from utils.bundle import CHECK_SECS as BUNDLE_CHECK_SECS, SEGMENTS, bundle_file, check_model, current_version, load_bundle
 
 # ---------------------------
 # Config
 # ---------------------------
 GEN_MODEL = os.getenv("OPENAI_GEN_MODEL", "gpt-5.2")
+SEARCH_MODE = os.getenv("SEARCH_MODE", "adaptive")  # adaptive | range
+# Per-query ANN knobs (0 = use the default stored in the index at build time)
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "0"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "0"))
+REFINE_K_FACTOR = float(os.getenv("REFINE_K_FACTOR", "0"))  # rescoring depth for refine indexes
 DEBUG = False  # set from args
 
 def _path(*parts):
@@ -43,20 +53,135 @@ def _path(*parts):
     p2 = os.path.join("Data", *parts)
     return p1 if os.path.exists(p1) else p2
 
+BUNDLE_ROOT = _path("bundles", SEGMENTS)  # ingest_index_json.py builds (utils/bundle.py); the files below are pre-bundle builds
 INDEX_PATH = _path("faiss2.index")
 DOCS_PATH  = _path("docs2.jsonl")
+INDEX_META_PATH = _path("faiss2.meta.json")
+PROJECTION_PATH = projection_path(INDEX_PATH)
 JAPAN_MAP_PATH = _path("japan.json")
 
 # ---------------------------
-# Sanity: index & docs
+# Index bundle (loaded on first use, hot-swapped when a new one is published)
 # ---------------------------
-missing = [p for p in (INDEX_PATH, DOCS_PATH) if not os.path.exists(p)]
-if missing:
-    sys.exit("❌ Missing files:\n  " + "\n  ".join(missing) +
-             "\nTip: re-run `ingest_index_json.py` with your current EMBEDDING_MODEL.")
+# FAISS_MMAP=1 maps the index file instead of reading it into process memory
+FAISS_MMAP = os.getenv("FAISS_MMAP", "1") == "1"
+
+class LoadedIndex:
+    """Everything a query reads from one build. Swapped as a unit, so a request never mixes two builds."""
+
+    def __init__(self, index, segments: SegmentStore, meta: Dict[str, Any],
+                 projection: Optional[Projection], version: Optional[str]):
+        self.index = index
+        self.segments = segments  # keyword / jp name / text columns + token index
+        self.meta = meta  # the build's index meta (type, params, benchmarks)
+        self.projection = projection  # set when the index was built at reduced dim
+        self.version = version  # bundle version, None for a pre-bundle build
+
+_live: Optional[LoadedIndex] = None
+_next_bundle_check = 0.0
+_reloading = False  # a background thread is opening a newly published bundle
+_load_lock = threading.Lock()  # guards the fields above; held for the first load, else only briefly
+
+def _read_index(path: str):
+    """Memory-map the index where this FAISS build/index type allows, else read it."""
+    if FAISS_MMAP:
+        ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)  # zero-copy flat codes (FAISS >= 1.8)
+        for flags in (ifc | faiss.IO_FLAG_MMAP, ifc, faiss.IO_FLAG_MMAP):
+            if not flags:
+                continue
+            try:
+                return faiss.read_index(path, flags)
+            except RuntimeError:
+                continue
+    return faiss.read_index(path)
+
+def _open_live() -> LoadedIndex:
+    """Open the CURRENT bundle (or the pre-bundle files); refuses a bundle built with another model."""
+    bundle = load_bundle(BUNDLE_ROOT)
+    if bundle is not None:
+        check_model(bundle.get("fingerprint"), model_fingerprint(), SEGMENTS)
+        index_path, docs_path = bundle_file(bundle, "index"), bundle_file(bundle, "docs")
+        meta_path, proj_path = bundle_file(bundle, "meta"), bundle_file(bundle, "projection")
+        bundle_version = bundle["version"]
+    else:
+        index_path, docs_path, meta_path, proj_path = INDEX_PATH, DOCS_PATH, INDEX_META_PATH, PROJECTION_PATH
+        bundle_version = None
+
+    missing = [p for p in (index_path, docs_path) if not p or not os.path.exists(p)]
+    if missing:
+        raise FileNotFoundError(
+            "Missing files:\n  " + "\n  ".join(str(p) for p in missing) +
+            "\nTip: re-run `ingest_index_json.py` with your current EMBEDDING_MODEL."
+        )
+    segs = SegmentStore.open(docs_path, japanese_names)
+    meta: Dict[str, Any] = {}
+    if meta_path and os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    proj = Projection.load(proj_path) if proj_path else None
+    idx = _read_index(index_path)
+    if proj is not None and proj.dim != idx.d:
+        raise RuntimeError(
+            f"{proj_path} maps to {proj.dim} dims but the index has {idx.d}. "
+            "Rebuild with `ingest_index_json.py`."
+        )
+    return LoadedIndex(idx, segs, meta, proj, bundle_version)
 
-index = faiss.read_index(INDEX_PATH)
-docs  = [json.loads(l) for l in open(DOCS_PATH, "r", encoding="utf-8")]
+def _reload_bundle() -> None:
+    """Open a newly published bundle off the request path; requests keep the old one until the swap."""
+    global _live, _reloading
+    try:
+        published = current_version(BUNDLE_ROOT)
+        if published and published != _live.version:
+            try:
+                loaded = _open_live()
+            except Exception as e:
+                print(f"⚠️ Keeping index bundle {_live.version}; cannot load {published}: {e}")
+            else:
+                with _load_lock:
+                    _live = loaded
+                print(f"🔄 Switched to index bundle {loaded.version}")
+    finally:
+        with _load_lock:
+            _reloading = False
+
+def current_index() -> LoadedIndex:
+    """
+    The live bundle. Loaded on first use (callers wait, there is nothing to
+    serve yet); afterwards CURRENT is checked at most every BUNDLE_CHECK_SECS
+    and a newly published bundle is opened on a background thread and swapped
+    in. Requests never wait for that load, and those holding the old
+    LoadedIndex finish on it. A bundle that fails to load (or has the wrong
+    model) leaves the old one serving.
+    """
+    global _live, _next_bundle_check, _reloading
+    live = _live
+    if live is None:
+        with _load_lock:
+            if _live is None:
+                _live = _open_live()
+                _next_bundle_check = time.monotonic() + BUNDLE_CHECK_SECS
+            return _live
+    if BUNDLE_CHECK_SECS > 0 and time.monotonic() >= _next_bundle_check:
+        with _load_lock:
+            start = not _reloading and time.monotonic() >= _next_bundle_check
+            if start:
+                _reloading = True
+                _next_bundle_check = time.monotonic() + BUNDLE_CHECK_SECS
+        if start:
+            threading.Thread(target=_reload_bundle, name="bundle-reload", daemon=True).start()
+    return live
+
+def load_index() -> Tuple[Any, Any]:
+    """
+    (FAISS index, segments) of the live bundle, loaded on first use. Both are
+    memory-mapped when the on-disk layout allows (see utils/segment_store.py),
+    so a load costs O(1) rather than O(corpus).
+    Raises FileNotFoundError if the files are missing, BundleMismatch if the
+    bundle was embedded with a different model than EMBEDDING_BACKEND/MODEL.
+    """
+    live = current_index()
+    return live.index, live.segments
 
 # Load Japanese name mapping (optional)
 japanese_names: Dict[str, str] = {}
@@ -67,57 +192,16 @@ else:
     print(f"⚠️  WARNING: Japanese mapping file not found at {JAPAN_MAP_PATH}")
     print("    Segment names will remain in English.")
 
-# Translation cache
-_translation_cache: Dict[str, str] = {}
-
-# ---------------------------
-# HTTPX client helper (handles 0.27 vs 0.28+)
-# ---------------------------
-def _make_httpx_client(proxy: Optional[str], timeout: float = 90.0) -> httpx.Client:
-    """
-    Create an httpx.Client that works across httpx versions.
-    httpx 0.28+ uses 'proxy='; 0.27- uses 'proxies='.
-    """
-    kw = "proxy" if version.parse(httpx.__version__) >= version.parse("0.28.0") else "proxies"
-    kwargs = {"timeout": timeout}
-    if proxy:
-        kwargs[kw] = proxy
-    try:
-        return httpx.Client(**kwargs)
-    except TypeError:
-        # Fallback if the current httpx doesn't support the chosen kw
-        kwargs.pop(kw, None)
-        alt_kw = "proxies" if kw == "proxy" else "proxy"
-        if proxy:
-            kwargs[alt_kw] = proxy
-        return httpx.Client(**kwargs)
-
-# ---------------------------
-# OpenAI client (singleton)
-# ---------------------------
-_OPENAI_CLIENT: Optional[OpenAI] = None
-
-def _openai_client() -> OpenAI:
-    global _OPENAI_CLIENT
-    if _OPENAI_CLIENT is not None:
-        return _OPENAI_CLIENT
-
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY not set.")
-
-    proxy = os.getenv("HTTPS_PROXY") or os.getenv("HTTP_PROXY") or os.getenv("ALL_PROXY")
-    http_client = _make_httpx_client(proxy, timeout=90.0)
-    _OPENAI_CLIENT = OpenAI(api_key=api_key, http_client=http_client)
-    return _OPENAI_CLIENT
-
-def _chat_create(client: OpenAI, model: str, messages: List[dict], temperature: float = 0.0, max_completion_tokens: Optional[int] = None):
+def _chat_create(client: OpenAI, model: str, messages: List[dict], temperature: float = 0.0, max_completion_tokens: Optional[int] = None,
+                 stream: bool = False):
     """
     Compatibility wrapper using max_completion_tokens for newer models
     """
     kwargs = {"model": model, "messages": messages, "temperature": temperature}
     if max_completion_tokens is not None:
         kwargs["max_completion_tokens"] = max_completion_tokens
+    if stream:
+        kwargs["stream"] = True
     return client.chat.completions.create(**kwargs)
 
 # ---------------------------
@@ -127,13 +211,6 @@ def debug_print(msg: str):
     if DEBUG:
         print(msg)
 
-def has_japanese(text: str) -> bool:
-    if not text:
-        return False
-    return any('\u3040' <= c <= '\u309F' or
-               '\u30A0' <= c <= '\u30FF' or
-               '\u4E00' <= c <= '\u9FAF' for c in text)
-
 def get_japanese_name(english_name: str) -> str:
     return japanese_names.get(english_name, english_name)
 
@@ -146,12 +223,14 @@ def _percent_from_cos(cos_val: float) -> float:
     # cosine (-1..1) → 0..100%
     return max(0.0, min(1.0, (cos_val + 1.0) / 2.0)) * 100.0
 
-def _tokenize_lower(s: str) -> set:
-    if not s:
-        return set()
-    english_terms = set(re.findall(r"[a-zA-Z0-9\-\+/#\.]+", s.lower()))
-    japanese_terms = set(re.findall(r"[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]+", s))
-    return english_terms | japanese_terms
+def _percent_from_cos_array(cos: np.ndarray) -> np.ndarray:
+    return np.clip((cos + 1.0) / 2.0, 0.0, 1.0) * 100.0
+
+def estimate_ctr_array(match_pct: np.ndarray, hit_counts: np.ndarray, base_ctr_pct: float = 1.0) -> np.ndarray:
+    """estimate_ctr_percent() over arrays, unrounded (callers round per row)."""
+    score_factor = 0.5 + 0.5 * (match_pct / 100.0)
+    kw_bonus = np.minimum(1.25, 1.0 + 0.02 * hit_counts)
+    return base_ctr_pct * score_factor * kw_bonus
 
 def estimate_ctr_percent(match_pct: float, hit_count: int, base_ctr_pct: float = 1.0) -> float:
     """
@@ -165,20 +244,20 @@ def estimate_ctr_percent(match_pct: float, hit_count: int, base_ctr_pct: float =
     return round(base_ctr_pct * score_factor * kw_bonus, 2)
 
 # ---------------------------
-# Translation (cached)
+# Translation (cached on disk, shared across processes)
 # ---------------------------
 def _cached_translate(key_prefix: str, text: str, sys_msg: str) -> str:
     if not text:
         return text
-    key = f"{key_prefix}:{text[:200]}"
-    if key in _translation_cache:
-        return _translation_cache[key]
 
     # Skip translation for very short text to save time/cost
     if len(text.strip()) < 15:
-        _translation_cache[key] = text
         return text
 
+    cached = get_cached(key_prefix, GEN_MODEL, text)
+    if cached is not None:
+        return cached
+
     try:
         client = _openai_client()
         resp = _chat_create(
@@ -192,11 +271,11 @@ def _cached_translate(key_prefix: str, text: str, sys_msg: str) -> str:
             max_completion_tokens=500
         )
         out = resp.choices[0].message.content.strip()
-        _translation_cache[key] = out
+        put_cached(key_prefix, GEN_MODEL, text, out)
         return out
     except Exception as e:
+        # Failures are not cached so the next request retries
         debug_print(f"⚠️ Translation failed ({key_prefix}): {e}")
-        _translation_cache[key] = text
         return text
 
 def translate_japanese_to_english(text: str) -> str:
@@ -255,7 +334,7 @@ def extract_keywords_ai(brief: str, max_terms: int = 20) -> List[str]:
         return out[:max_terms]
     except Exception as e:
         debug_print(f"Keyword extraction failed, falling back: {e}")
-        toks = [t for t in _tokenize_lower(brief) if len(t) > 1]
+        toks = [t for t in tokenize_lower(brief) if len(t) > 1]
         out, seen = [], set()
         for t in list(toks)[:max_terms]:
             if t not in seen:
@@ -263,21 +342,202 @@ def extract_keywords_ai(brief: str, max_terms: int = 20) -> List[str]:
                 out.append(t)
         return out
 
+def _extract_keywords_en(brief: str, max_terms: int = 20) -> Tuple[List[str], Optional[str]]:
+    """Keyword extraction followed by JP->EN of the joined keywords (for embedding)."""
+    ai_kws = extract_keywords_ai(brief, max_terms=max_terms)
+    if not ai_kws:
+        return ai_kws, None
+    # Embed keywords: join them; translate JP->EN so embedding space consistent
+    return ai_kws, translate_japanese_to_english(" | ".join(ai_kws))
+
 # ---------------------------
 # Step 2: Retrieval
 # ---------------------------
+# Pre-retrieval LLM calls are independent (brief translation vs. keyword
+# extraction -> keyword translation), so they run side by side.
+_PRE_RETRIEVAL_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PRE_RETRIEVAL_WORKERS", "8")), thread_name_prefix="pre-retrieval"
+)
+
+def _faiss_search_params(index, ef_search: Optional[int] = None, nprobe: Optional[int] = None):
+    """
+    SearchParameters for this query, or None to use the index's stored defaults.
+    Quantized indexes built with --rescore are wrapped in IndexRefine; the
+    HNSW/IVF knobs then apply to its base index.
+    """
+    ef_search = ef_search or HNSW_EF_SEARCH
+    nprobe = nprobe or IVF_NPROBE
+    base = faiss.downcast_index(index.base_index) if isinstance(index, faiss.IndexRefine) else index
+
+    params = None
+    if ef_search and isinstance(base, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    elif nprobe and isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(nprobe=int(nprobe))
+
+    if base is not index and (params is not None or REFINE_K_FACTOR):
+        refine = faiss.IndexRefineSearchParameters(k_factor=REFINE_K_FACTOR or index.k_factor)
+        if params is not None:
+            refine.base_index_params = params
+        return refine
+    return params
+
+def _range_search_ok(index) -> bool:
+    """Range search only where it returns what adaptive search would: flat and IVF codes, no refine."""
+    if isinstance(index, faiss.IndexRefine):
+        return False
+    return not isinstance(faiss.downcast_index(index), faiss.IndexHNSW)
+
+def _search_candidates(
+    live: LoadedIndex,
+    q_vec: np.ndarray,
+    top_k: int,
+    min_cos: float,
+    mode: str = "adaptive",
+    stats: Optional[dict] = None,
+    params=None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fetch only as many neighbours as top_k/min_cos need. Returns (D_row, I_row)
+    sorted by cosine desc.
+      adaptive: start at k = 2*top_k, double while fewer than top_k distinct
+                keywords clear min_cos and the last hit still clears it
+      range:    FAISS range search at min_cos on flat/IVF indexes (falls back to
+                adaptive on HNSW or refine-wrapped indexes, whose range search
+                skips the graph walk / rescoring and can silently come back short,
+                and on index types without range search)
+    """
+    index, segments, index_meta = live.index, live.segments, live.meta
+    q = np.array([q_vec], dtype="float32")
+    n = index.ntotal
+
+    if mode == "range" and not _range_search_ok(index):
+        debug_print(f"Range search not exact for {index_meta.get('index_type', 'this index')}; using adaptive search")
+    elif mode == "range":
+        try:
+            # IP range search keeps scores > radius; nudge so cos == min_cos is kept
+            radius = float(min_cos) - 1e-6
+            lims, D, I = (index.range_search(q, radius, params=params) if params is not None
+                          else index.range_search(q, radius))
+            order = np.argsort(-D, kind="stable")
+            if stats is not None:
+                stats.update({"search_mode": "range", "candidates_examined": int(len(I)), "search_rounds": 1,
+                              "index_type": index_meta.get("index_type", "flat")})
+            return D[order], I[order]
+        except RuntimeError as e:
+            debug_print(f"Range search unavailable ({e}); using adaptive search")
+
+    k = min(n, max(top_k * 2, 16))
+    rounds = 0
+    while True:
+        rounds += 1
+        D, I = index.search(q, k, params=params) if params is not None else index.search(q, k)
+        D_row, I_row = D[0], I[0]
+        above = (D_row >= min_cos) & (I_row >= 0)
+        if (k >= n or D_row[-1] < min_cos
+                or len(np.unique(segments.key_ids[I_row[above]])) >= top_k):
+            break
+        k = min(n, k * 2)
+
+    if stats is not None:
+        stats.update({"search_mode": "adaptive", "candidates_examined": int(k), "search_rounds": rounds,
+                      "index_type": index_meta.get("index_type", "flat")})
+    return D_row, I_row
+
+def _score_candidates(
+    segments: SegmentStore,
+    D_row: np.ndarray,
+    I_row: np.ndarray,
+    top_k: int,
+    min_cos: float,
+    query_ids: np.ndarray,
+    base_ctr_pct: float
+) -> List[dict]:
+    """
+    Vectorized selection over one FAISS result row:
+      1) drop padding (-1) ids
+      2) dedup by keyword ID, keeping each keyword's best-ranked hit
+      3) keep cosine >= min_cos (a keyword whose best hit is below it is dropped)
+      4) take top_k by cosine; dicts are built only for those rows
+    """
+    valid = I_row >= 0
+    ids = I_row[valid].astype("int64")
+    cos = D_row[valid].astype("float64")  # float64 so scores match the scalar helpers
+
+    _, first = np.unique(segments.key_ids[ids], return_index=True)
+    keep = np.sort(first)
+    ids, cos = ids[keep], cos[keep]
+
+    above = cos >= min_cos
+    ids, cos = ids[above], cos[above]
+
+    order = np.argsort(-cos, kind="stable")[:top_k]
+    ids, cos = ids[order], cos[order]
+
+    hit_lists = [segments.terms.hits(int(i), query_ids) for i in ids]
+    match_pct = _percent_from_cos_array(cos)
+    est_ctr = estimate_ctr_array(match_pct, np.array([len(h) for h in hit_lists]), base_ctr_pct)
+
+    rows: List[dict] = []
+    for j, idx in enumerate(ids):
+        rows.append({
+            "keyword": segments.keyword(idx),
+            "jp_name": segments.jp_name(idx),
+            "text": segments.text(idx),
+            "cosine": float(cos[j]),
+            "match_pct": float(match_pct[j]),
+            "hits": hit_lists[j][:20],
+            "est_ctr_pct": round(float(est_ctr[j]), 2),
+            "snippet_ja": segments.snippet_ja(idx)
+        })
+    return rows
+
+def _embed_query(brief: str, use_extract: bool, kw_weight: float,
+                 projection: Optional[Projection] = None) -> Tuple[np.ndarray, List[str]]:
+    """
+    Build the query vector. The keyword path runs on the pool while this thread
+    translates the brief; both texts are then embedded in one batch call.
+    """
+    kw_future = _PRE_RETRIEVAL_POOL.submit(_extract_keywords_en, brief, 20) if use_extract else None
+
+    # Use English for embedding if brief is JP (better embedding match)
+    emb_text = translate_japanese_to_english(brief)
+    ai_kws, kws_text_en = kw_future.result() if kw_future is not None else ([], None)
+
+    texts = [emb_text] + ([kws_text_en] if kws_text_en else [])
+    vecs = get_embeddings_batch(texts)
+    emb_brief = _normalize(vecs[0])
+    if len(vecs) < 2:
+        return _to_index_space(emb_brief, projection), ai_kws
+
+    # Blend query vectors if keyword embedding exists
+    emb_kw = _normalize(vecs[1])
+    w = float(max(0.0, min(1.0, kw_weight)))
+    return _to_index_space(_normalize((1.0 - w) * emb_brief + w * emb_kw), projection), ai_kws
+
+def _to_index_space(q: np.ndarray, projection: Optional[Projection]) -> np.ndarray:
+    # Same projection the index was built with (identity at full width)
+    return projection.apply(q) if projection is not None else q
+
 def retrieve_segments_detailed(
     brief: str,
     top_k: int = 10,
     use_extract: bool = True,
     kw_weight: float = 0.4,
     min_cos: float = 0.20,
-    base_ctr_pct: float = 1.0
+    base_ctr_pct: float = 1.0,
+    search_mode: Optional[str] = None,
+    stats: Optional[dict] = None,
+    ef_search: Optional[int] = None,
+    nprobe: Optional[int] = None
 ) -> Tuple[List[dict], List[str], Optional[str]]:
     """
     Returns: (rows, ai_kws, error_msg)
     Each row includes:
       keyword, jp_name, text, cosine, match_pct, hits, est_ctr
+    If `stats` is given it is filled with search_mode, candidates_examined,
+    search_rounds, index_type and bundle (version). ef_search / nprobe override the HNSW / IVF
+    defaults for this query only.
     """
     try:
         if not brief or len(brief.strip()) < 10:
@@ -285,108 +545,34 @@ def retrieve_segments_detailed(
         if top_k < 1:
             return [], [], "top_k must be >= 1"
 
+        live = current_index()  # one bundle for the whole request, even across a hot swap
+        segments = live.segments
+
         debug_print(f"Brief: {brief[:120]}")
 
-        # Use English for embedding if brief is JP (better embedding match)
-        emb_text = translate_japanese_to_english(brief)
-        emb_brief = _normalize(get_embedding(emb_text))
-
-        ai_kws: List[str] = []
-        emb_kw: Optional[np.ndarray] = None
-        if use_extract:
-            ai_kws = extract_keywords_ai(brief, max_terms=20)
-            if ai_kws:
-                # Embed keywords: join them; translate JP->EN so embedding space consistent
-                kws_text = " | ".join(ai_kws)
-                kws_text_en = translate_japanese_to_english(kws_text)
-                emb_kw = _normalize(get_embedding(kws_text_en))
-
-        # Blend query vectors if keyword embedding exists
-        q_vec = emb_brief
-        if emb_kw is not None:
-            w = float(max(0.0, min(1.0, kw_weight)))
-            q_vec = _normalize((1.0 - w) * emb_brief + w * emb_kw)
-
-        # Search
-        search_size = min(max(top_k * 8, 50), len(docs))
-        D, I = index.search(np.array([q_vec], dtype="float32"), search_size)
-
-        # Token sets for hits
-        brief_terms = _tokenize_lower(brief)
-        kws_terms = set()
-        for k in ai_kws:
-            kws_terms |= _tokenize_lower(k)
-
-        rows: List[dict] = []
-        seen = set()
-
-        # Primary pass: min_cos
-        for rank, idx in enumerate(I[0]):
-            if len(rows) >= top_k:
-                break
-            rec = docs[idx]
-            key = rec.get("keyword") or f"seg_{idx}"
-            if key in seen:
-                continue
-            seen.add(key)
+        q_vec, ai_kws = _embed_query(brief, use_extract, kw_weight, live.projection)
 
-            text = (rec.get("text") or rec.get("answer") or "")
-            cos = float(D[0][rank])
+        # Search (only as deep as top_k / min_cos require)
+        D_row, I_row = _search_candidates(
+            live, q_vec, top_k, min_cos, mode=search_mode or SEARCH_MODE, stats=stats,
+            params=_faiss_search_params(live.index, ef_search, nprobe)
+        )
+        if stats is not None:
+            stats["bundle"] = live.version
 
-            if cos < min_cos:
-                continue
+        # Token sets for hits (doc side is precomputed in segments.terms)
+        brief_terms = tokenize_lower(brief)
+        kws_terms = set()
+        for k in ai_kws:
+            kws_terms |= tokenize_lower(k)
+        query_ids = segments.terms.lookup(brief_terms | kws_terms)
 
-            seg_terms = _tokenize_lower(text) | _tokenize_lower(key)
-            hits = sorted((brief_terms | kws_terms) & seg_terms)
-            match_pct = _percent_from_cos(cos)
-            est_ctr = estimate_ctr_percent(match_pct, hit_count=len(hits), base_ctr_pct=base_ctr_pct)
-
-            rows.append({
-                "keyword": key,
-                "jp_name": get_japanese_name(key),
-                "text": text,
-                "cosine": cos,
-                "match_pct": match_pct,
-                "hits": hits[:20],
-                "est_ctr_pct": est_ctr
-            })
-
-        # Fallback: if not enough, just take top remaining (lower threshold) but keep ranking honest
-        if len(rows) < top_k:
-            for rank, idx in enumerate(I[0]):
-                if len(rows) >= top_k:
-                    break
-                rec = docs[idx]
-                key = rec.get("keyword") or f"seg_{idx}"
-                if key in seen:
-                    continue
-                seen.add(key)
-
-                text = (rec.get("text") or rec.get("answer") or "")
-                cos = float(D[0][rank])
-
-                seg_terms = _tokenize_lower(text) | _tokenize_lower(key)
-                hits = sorted((brief_terms | kws_terms) & seg_terms)
-                match_pct = _percent_from_cos(cos)
-                est_ctr = estimate_ctr_percent(match_pct, hit_count=len(hits), base_ctr_pct=base_ctr_pct)
-
-                rows.append({
-                    "keyword": key,
-                    "jp_name": get_japanese_name(key),
-                    "text": text,
-                    "cosine": cos,
-                    "match_pct": match_pct,
-                    "hits": hits[:20],
-                    "est_ctr_pct": est_ctr
-                })
-
-        # Sort by cosine desc (FAISS already mostly does, but fallback pass can append)
-        rows.sort(key=lambda r: r["cosine"], reverse=True)
+        rows = _score_candidates(segments, D_row, I_row, top_k, min_cos, query_ids, base_ctr_pct)
 
         if not rows:
             return [], ai_kws, "No matching segments found. Try different keywords or rebuild the index."
 
-        return rows[:top_k], ai_kws, None
+        return rows, ai_kws, None
 
     except Exception as e:
         traceback.print_exc()
@@ -397,7 +583,7 @@ def retrieve_segments_detailed(
 # ---------------------------
 def _build_generation_prompt_json(campaign_brief: str, rows: List[dict]) -> str:
     """
-    Provide per-segment text in Japanese (translate only if needed),
+    Provide per-segment text in Japanese (precomputed snippet_ja, else translate),
     force JSON output for validation.
     """
     blocks = []
@@ -405,8 +591,11 @@ def _build_generation_prompt_json(campaign_brief: str, rows: List[dict]) -> str:
     for i, r in enumerate(rows, 1):
         name = r["jp_name"]
         allowed_names.append(name)
-        snippet = (r["text"] or "")[:420]
-        snippet_ja = translate_english_to_japanese(snippet) if not has_japanese(snippet) else snippet
+        # Precomputed by `ingest_index_json.py --localize`; translate only as a fallback
+        snippet_ja = r.get("snippet_ja")
+        if not snippet_ja:
+            snippet = (r["text"] or "")[:420]
+            snippet_ja = translate_english_to_japanese(snippet) if not has_japanese(snippet) else snippet
         blocks.append(
             f"Segment {i}: {name}\n"
             f"Text_JA: {snippet_ja}\n"
@@ -455,6 +644,36 @@ def _generate_segments_json(prompt: str) -> str:
     )
     return resp.choices[0].message.content.strip()
 
+def _validate_segment(obj: Any, allowed_set: set, seen: set) -> Optional[dict]:
+    """One generated object -> cleaned dict, or None if it is invalid or a repeat (adds to `seen`)."""
+    if not isinstance(obj, dict):
+        return None
+    name = obj.get("segment_name")
+    why = obj.get("why_it_fits")
+    kws = obj.get("keywords")
+
+    if not isinstance(name, str) or name not in allowed_set:
+        return None
+    if name in seen:
+        return None
+    if not isinstance(why, str) or len(why.strip()) < 3:
+        return None
+    if not (isinstance(kws, list) and len(kws) == 10 and all(isinstance(x, str) and x.strip() for x in kws)):
+        return None
+
+    seen.add(name)
+    return {
+        "segment_name": name,
+        "why_it_fits": why.strip(),
+        "keywords": [k.strip() for k in kws]
+    }
+
+def _check_complete(allowed: List[str], seen: set) -> None:
+    # Ensure we have all segments. If not, hard fail so you notice instead of silently lying.
+    if len(seen) != len(allowed):
+        missing = [n for n in allowed if n not in seen]
+        raise ValueError(f"Incomplete generation. Missing segments: {missing}")
+
 def _validate_and_render(campaign_brief: str, rows: List[dict], json_text: str) -> Tuple[str, List[dict]]:
     allowed = [r["jp_name"] for r in rows]
     allowed_set = set(allowed)
@@ -469,35 +688,11 @@ def _validate_and_render(campaign_brief: str, rows: List[dict], json_text: str)
 
     # Validate objects
     seen = set()
-    cleaned: List[dict] = []
-    for obj in data:
-        if not isinstance(obj, dict):
-            continue
-        name = obj.get("segment_name")
-        why = obj.get("why_it_fits")
-        kws = obj.get("keywords")
-
-        if not isinstance(name, str) or name not in allowed_set:
-            continue
-        if name in seen:
-            continue
-        if not isinstance(why, str) or len(why.strip()) < 3:
-            continue
-        if not (isinstance(kws, list) and len(kws) == 10 and all(isinstance(x, str) and x.strip() for x in kws)):
-            continue
-
-        seen.add(name)
-        cleaned.append({
-            "segment_name": name,
-            "why_it_fits": why.strip(),
-            "keywords": [k.strip() for k in kws]
-        })
-
-    # Ensure we have all segments. If not, hard fail so you notice instead of silently lying.
-    if len(cleaned) != len(allowed):
-        missing = [n for n in allowed if n not in seen]
-        raise ValueError(f"Incomplete generation. Missing segments: {missing}")
+    cleaned = [c for c in (_validate_segment(obj, allowed_set, seen) for obj in data) if c is not None]
+    _check_complete(allowed, seen)
+    return _render_markdown(allowed, cleaned), cleaned
 
+def _render_markdown(allowed: List[str], cleaned: List[dict]) -> str:
     # Render markdown in stable order
     cleaned_by_name = {c["segment_name"]: c for c in cleaned}
 
@@ -510,7 +705,249 @@ def _validate_and_render(campaign_brief: str, rows: List[dict], json_text: str)
         md_lines.append("**Keywords:** " + "、".join(c["keywords"]))
         md_lines.append("")  # blank line
 
-    return "\n".join(md_lines).strip(), cleaned
+    return "\n".join(md_lines).strip()
+
+def generate_segments(campaign_brief: str, rows: List[dict]) -> Tuple[str, List[dict]]:
+    """
+    Full generation step for already-retrieved rows: prompt -> model -> validated JSON.
+    Returns (markdown, cleaned). Raises ValueError on invalid/incomplete output.
+    """
+    prompt = _build_generation_prompt_json(campaign_brief, rows)
+    raw_json = _generate_segments_json(prompt)
+    return _validate_and_render(campaign_brief, rows, raw_json)
+
+# ---------------------------
+# Step 3b: Streaming generation (segments as they complete)
+# ---------------------------
+class JsonArrayStream:
+    """
+    Incremental parser for a streamed top-level JSON array: feed() text deltas,
+    get back every element completed so far. Text before the first '[' (e.g. a
+    ```json fence) is skipped; `closed` turns True at the matching ']'.
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0          # scan position in buf
+        self.depth = 0        # 0 = before the array, 1 = between elements
+        self.start = None     # buf index where the current element began
+        self.in_string = False
+        self.escape = False
+        self.closed = False
+
+    def feed(self, text: str) -> List[Any]:
+        self.buf += text
+        out: List[Any] = []
+        buf = self.buf
+        i = self.pos
+        while i < len(buf) and not self.closed:
+            c = buf[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif self.depth == 0:
+                if c == "[":
+                    self.depth = 1
+            elif c == '"':
+                self.in_string = True
+                if self.depth == 1:
+                    self.start = i
+            elif c in "[{":
+                if self.depth == 1:
+                    self.start = i
+                self.depth += 1
+            elif c in "]}":
+                if self.depth == 1 and self.start is not None:
+                    out.append(json.loads(buf[self.start:i]))  # last element, a scalar
+                    self.start = None
+                self.depth -= 1
+                if self.depth == 0:
+                    self.closed = True
+                elif self.depth == 1 and self.start is not None:
+                    out.append(json.loads(buf[self.start:i + 1]))
+                    self.start = None
+            elif self.depth == 1 and c == "," and self.start is not None:
+                out.append(json.loads(buf[self.start:i]))  # scalar element
+                self.start = None
+            elif self.depth == 1 and self.start is None and not c.isspace() and c != ",":
+                self.start = i
+            i += 1
+        # Drop what has been consumed so the buffer stays one element long
+        cut = self.start if self.start is not None else i
+        self.buf, self.pos = buf[cut:], i - cut
+        if self.start is not None:
+            self.start = 0
+        return out
+
+def _stream_segments_json(prompt: str) -> Iterator[str]:
+    """Text deltas of the generation completion (same request as _generate_segments_json)."""
+    client = _openai_client()
+    stream = _chat_create(
+        client,
+        model=GEN_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.0,
+        max_completion_tokens=2500,
+        stream=True
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def generate_segments_stream(campaign_brief: str, rows: List[dict]) -> Iterator[dict]:
+    """
+    generate_segments(), one validated object at a time as the model finishes it.
+    Objects pass the same checks as _validate_and_render; after the last one the
+    same ValueError is raised if the JSON was cut off or segments are missing.
+    """
+    allowed = [r["jp_name"] for r in rows]
+    allowed_set = set(allowed)
+    seen: set = set()
+    parser = JsonArrayStream()
+    prompt = _build_generation_prompt_json(campaign_brief, rows)
+    try:
+        for delta in _stream_segments_json(prompt):
+            for obj in parser.feed(delta):
+                cleaned = _validate_segment(obj, allowed_set, seen)
+                if cleaned is not None:
+                    yield cleaned
+    except json.JSONDecodeError:
+        raise ValueError("Model did not return valid JSON.")
+    if not parser.closed:
+        raise ValueError("Model did not return valid JSON.")
+    _check_complete(allowed, seen)
+
+def run_pipeline_stream(
+    brief: str,
+    top_k: int = 10,
+    use_extract: bool = True,
+    kw_weight: float = 0.4,
+    min_cos: float = 0.20,
+    base_ctr_pct: float = 1.0,
+    save: bool = True,
+    search_mode: Optional[str] = None,
+    ef_search: Optional[int] = None,
+    nprobe: Optional[int] = None
+) -> Iterator[Tuple[str, Any]]:
+    """
+    run_pipeline() as events:
+      ("retrieval", build_result() without generation)  as soon as the search is done
+      ("segment", validated generation object)          once per segment, in model order
+      ("done", build_result() with generation/markdown or generation_error)
+    "done" is what run_pipeline() returns: on a generation error there is no
+    generation, so segments already sent must be discarded by the consumer.
+    A retrieval error ends the stream after the "retrieval" event (its "error" is set).
+    """
+    stats: Dict[str, Any] = {}
+    rows, ai_kws, error = retrieve_segments_detailed(
+        brief=brief,
+        top_k=top_k,
+        use_extract=use_extract,
+        kw_weight=max(0.0, min(1.0, kw_weight)),
+        min_cos=min_cos,
+        base_ctr_pct=base_ctr_pct,
+        search_mode=search_mode,
+        stats=stats,
+        ef_search=ef_search,
+        nprobe=nprobe
+    )
+    yield "retrieval", build_result(brief, top_k, rows, ai_kws, error=error, search_stats=stats)
+    if error:
+        return
+
+    cleaned: List[dict] = []
+    try:
+        for obj in generate_segments_stream(brief, rows):
+            cleaned.append(obj)
+            yield "segment", obj
+    except Exception as e:
+        if DEBUG:
+            traceback.print_exc()
+        yield "done", build_result(brief, top_k, rows, ai_kws, generation_error=str(e), search_stats=stats)
+        return
+
+    md = _render_markdown([r["jp_name"] for r in rows], cleaned)
+    if save:
+        save_generation(brief, ai_kws, rows, md_output=md, generation_json=cleaned)
+    yield "done", build_result(brief, top_k, rows, ai_kws, generation=cleaned, markdown=md, search_stats=stats)
+
+# ---------------------------
+# Structured output (JSON mode / in-process callers)
+# ---------------------------
+def build_result(
+    brief: str,
+    top_k: int,
+    rows: List[dict],
+    ai_kws: List[str],
+    error: Optional[str] = None,
+    generation: Optional[List[dict]] = None,
+    markdown: Optional[str] = None,
+    generation_error: Optional[str] = None,
+    search_stats: Optional[dict] = None
+) -> Dict[str, Any]:
+    """
+    One JSON-serializable document with the exact retrieval rows
+    (cosine, match_pct, hits, est_ctr_pct) and the validated generation list.
+    """
+    return {
+        "brief": brief,
+        "top_k": top_k,
+        "ai_keywords": ai_kws,
+        "rows": rows,
+        "search_stats": search_stats or {},
+        "error": error,
+        "generation": generation,
+        "markdown": markdown,
+        "generation_error": generation_error
+    }
+
+def run_pipeline(
+    brief: str,
+    top_k: int = 10,
+    use_extract: bool = True,
+    kw_weight: float = 0.4,
+    min_cos: float = 0.20,
+    base_ctr_pct: float = 1.0,
+    retrieval_only: bool = False,
+    save: bool = True,
+    search_mode: Optional[str] = None,
+    ef_search: Optional[int] = None,
+    nprobe: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Retrieval (+ optional generation) returning build_result()'s document.
+    Generation failures are reported in "generation_error"; rows are kept.
+    """
+    stats: Dict[str, Any] = {}
+    rows, ai_kws, error = retrieve_segments_detailed(
+        brief=brief,
+        top_k=top_k,
+        use_extract=use_extract,
+        kw_weight=max(0.0, min(1.0, kw_weight)),
+        min_cos=min_cos,
+        base_ctr_pct=base_ctr_pct,
+        search_mode=search_mode,
+        stats=stats,
+        ef_search=ef_search,
+        nprobe=nprobe
+    )
+    if error or retrieval_only:
+        return build_result(brief, top_k, rows, ai_kws, error=error, search_stats=stats)
+
+    try:
+        md, cleaned = generate_segments(brief, rows)
+    except Exception as e:
+        if DEBUG:
+            traceback.print_exc()
+        return build_result(brief, top_k, rows, ai_kws, generation_error=str(e), search_stats=stats)
+
+    if save:
+        save_generation(brief, ai_kws, rows, md_output=md, generation_json=cleaned)
+    return build_result(brief, top_k, rows, ai_kws, generation=cleaned, markdown=md, search_stats=stats)
 
 # ---------------------------
 # Output 1: Pretty printing
@@ -567,23 +1004,52 @@ def main():
     ap.add_argument("--min-cos", type=float, default=0.20, help="Minimum cosine threshold for primary pass.")
     ap.add_argument("--retrieval-only", action="store_true", help="Only print matches, skip generation.")
     ap.add_argument("--base-ctr", type=float, default=1.0, help="Base CTR %% prior (default 1.0).")
+    ap.add_argument("--search-mode", choices=["adaptive", "range"], default=SEARCH_MODE,
+                    help="Candidate fetch: adaptive expanding-k or FAISS range search at --min-cos.")
+    ap.add_argument("--ef-search", type=int, default=None, help="HNSW efSearch for this query (HNSW indexes).")
+    ap.add_argument("--nprobe", type=int, default=None, help="IVF nprobe for this query (IVF indexes).")
+    ap.add_argument("--json", action="store_true", help="Print one JSON document (rows + generation) instead of text.")
     ap.add_argument("--debug", action="store_true", help="Show debug output.")
     args = ap.parse_args()
 
     DEBUG = args.debug
 
+    try:
+        load_index()
+    except FileNotFoundError as e:
+        sys.exit(f"❌ {e}")
+
     brief = args.brief or input("Enter campaign brief: ").strip()
     if not brief:
         print("❌ Campaign brief is required")
         return
 
+    if args.json:
+        doc = run_pipeline(
+            brief=brief,
+            top_k=args.top_k,
+            use_extract=not args.no_extract,
+            kw_weight=args.kw_weight,
+            min_cos=args.min_cos,
+            base_ctr_pct=args.base_ctr,
+            retrieval_only=args.retrieval_only,
+            search_mode=args.search_mode,
+            ef_search=args.ef_search,
+            nprobe=args.nprobe
+        )
+        print(json.dumps(doc, ensure_ascii=False))
+        return
+
     rows, ai_kws, error = retrieve_segments_detailed(
         brief=brief,
         top_k=args.top_k,
         use_extract=not args.no_extract,
         kw_weight=max(0.0, min(1.0, args.kw_weight)),
         min_cos=args.min_cos,
-        base_ctr_pct=args.base_ctr
+        base_ctr_pct=args.base_ctr,
+        search_mode=args.search_mode,
+        ef_search=args.ef_search,
+        nprobe=args.nprobe
     )
 
     if error:
@@ -596,9 +1062,7 @@ def main():
         return
 
     try:
-        prompt = _build_generation_prompt_json(brief, rows)
-        raw_json = _generate_segments_json(prompt)
-        md, cleaned = _validate_and_render(brief, rows, raw_json)
+        md, cleaned = generate_segments(brief, rows)
 
         print("\n" + md + "\n")
         save_generation(brief, ai_kws, rows, md_output=md, generation_json=cleaned)
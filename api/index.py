@@ -2,89 +2,166 @@ from http.server import BaseHTTPRequestHandler
 import json
 import os
 import re
+import sys
+import time
 import traceback
 import numpy as np
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.segment_store import SegmentStore, tokenize_lower
+from utils.projection import Projection, projection_path
+from utils.bundle import CHECK_SECS as BUNDLE_CHECK_SECS, SERVERLESS, bundle_file, bundle_root, check_model, current_version, load_bundle
+from utils import query_cache
+
 # ------------------------------------
 # Load pre-computed embeddings and data
 # ------------------------------------
-_embeddings = None
-_keywords = None
-_docs = None
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_BUNDLE_ROOT = bundle_root(os.path.join(_BASE_DIR, 'Data'), SERVERLESS)  # create_embeddings.py builds
+# Query embeddings always come from OpenAI here; a bundle built with another model is refused
+QUERY_MODEL = os.environ.get('EMBEDDING_MODEL') or 'text-embedding-3-small'
+
+# (embeddings, segments, projection, bundle version) of one build, swapped as a unit
+_live = None
+_next_bundle_check = 0.0
+_load_error = None  # why search data is unavailable (e.g. model mismatch), for the response
 _japan_map = None
+_keyword_index = None  # japan.json lookup tables for _get_related_keywords, built with _japan_map
+
+def _load_embeddings(npy_path, npz_path):
+    """Pre-normalized .npy is only mapped, not read; the legacy .npz is loaded (and normalized if needed)."""
+    if os.path.exists(npy_path):
+        return np.load(npy_path, mmap_mode='r')
+    if not os.path.exists(npz_path):
+        return None
+    data = np.load(npz_path)
+    embeddings = data['embeddings']
+    # Keep float16 storage as-is (half the memory); anything else becomes float32
+    if embeddings.dtype not in (np.float16, np.float32):
+        embeddings = embeddings.astype('float32')
+    # Builds mark pre-normalized vectors; older files are normalized in place (no second copy)
+    if not ('normalized' in data.files and bool(data['normalized'])):
+        norms = np.sqrt(np.einsum('ij,ij->i', embeddings, embeddings, dtype=np.float32))[:, None] + 1e-12
+        np.divide(embeddings, norms, out=embeddings, casting='unsafe')
+    return embeddings
+
+def _open_live():
+    """Vectors + segments + projection of the CURRENT bundle, or of the pre-bundle Data/ files."""
+    bundle = load_bundle(_BUNDLE_ROOT)
+    if bundle is not None:
+        check_model(bundle.get('fingerprint'), 'openai:' + QUERY_MODEL, SERVERLESS)
+        vectors_path, docs_path = bundle_file(bundle, 'vectors'), bundle_file(bundle, 'docs')
+        proj_path, version = bundle_file(bundle, 'projection'), bundle['version']
+        embeddings = np.load(vectors_path, mmap_mode='r')
+    else:
+        npy_path = os.path.join(_BASE_DIR, 'Data', 'embeddings.npy')
+        embeddings = _load_embeddings(npy_path, os.path.join(_BASE_DIR, 'Data', 'embeddings.npz'))
+        if embeddings is None:
+            return None
+        docs_path, proj_path, version = os.path.join(_BASE_DIR, 'Data', 'docs.jsonl'), projection_path(npy_path), None
+    projection = Projection.load(proj_path) if proj_path else None
+    # Segments (keyword, Japanese name, text) for every embedding row
+    segments = SegmentStore.open(docs_path, _japan_map) if docs_path and os.path.exists(docs_path) else None
+    keywords_path = os.path.join(_BASE_DIR, 'Data', 'keywords.json')
+    if segments is None and version is None and os.path.exists(keywords_path):
+        # The shipped data has names only (keywords.json, one per embedding row), no docs.jsonl
+        with open(keywords_path, 'r', encoding='utf-8') as f:
+            segments = SegmentStore.from_keywords(json.load(f), _japan_map)
+    return embeddings, segments, projection, version
 
 def _load_search_data():
-    """Load embeddings and document data for vector search"""
-    global _embeddings, _keywords, _docs, _japan_map
+    """
+    Load embeddings and document data for vector search on first use; afterwards
+    look for a newly published bundle every BUNDLE_CHECK_SECS and swap it in
+    (a bundle that fails to load leaves the current one serving).
+    """
+    global _live, _next_bundle_check, _load_error, _japan_map, _keyword_index
     
-    if _embeddings is not None:
+    if _live is not None and (BUNDLE_CHECK_SECS <= 0 or time.monotonic() < _next_bundle_check):
         return True
     
     try:
-        base_dir = os.path.dirname(os.path.dirname(__file__))
-        
-        # Load embeddings
-        emb_path = os.path.join(base_dir, 'Data', 'embeddings.npz')
-        if os.path.exists(emb_path):
-            data = np.load(emb_path)
-            _embeddings = data['embeddings'].astype('float32')
-            # Normalize embeddings for cosine similarity
-            norms = np.linalg.norm(_embeddings, axis=1, keepdims=True) + 1e-12
-            _embeddings = _embeddings / norms
-        else:
-            return False
-        
-        # Load keywords/segment names
-        kw_path = os.path.join(base_dir, 'Data', 'keywords.json')
-        if os.path.exists(kw_path):
-            with open(kw_path, 'r', encoding='utf-8') as f:
-                _keywords = json.load(f)
-        
-        # Load docs for text content
-        docs_path = os.path.join(base_dir, 'Data', 'docs.jsonl')
-        if os.path.exists(docs_path):
-            _docs = []
-            with open(docs_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    _docs.append(json.loads(line))
+        if _japan_map is None:
+            # Load Japanese name mapping
+            japan_path = os.path.join(_BASE_DIR, 'Data', 'japan.json')
+            if os.path.exists(japan_path):
+                with open(japan_path, 'r', encoding='utf-8') as f:
+                    _japan_map = json.load(f)
+            else:
+                _japan_map = {}
+            _keyword_index = _build_keyword_index(_japan_map)
         
-        # Load Japanese name mapping
-        japan_path = os.path.join(base_dir, 'Data', 'japan.json')
-        if os.path.exists(japan_path):
-            with open(japan_path, 'r', encoding='utf-8') as f:
-                _japan_map = json.load(f)
+        if _live is None:
+            _live = _open_live()
         else:
-            _japan_map = {}
-        
-        return True
+            published = current_version(_BUNDLE_ROOT)
+            if published and published != _live[3]:
+                try:
+                    _live = _open_live() or _live
+                    print(f"Switched to index bundle {published}")
+                except Exception as e:
+                    print(f"Keeping index bundle {_live[3]}; cannot load {published}: {e}")
+        _next_bundle_check = time.monotonic() + BUNDLE_CHECK_SECS
+        _load_error = None
+        return _live is not None
     except Exception as e:
+        _load_error = str(e)
         print(f"Error loading search data: {e}")
         return False
 
-def _get_embedding_openai(text, client, model="text-embedding-3-small"):
-    """Get embedding for query text using OpenAI"""
+def _embedding_key(text, model=QUERY_MODEL):
+    return query_cache.cache_key('embedding', model, query_cache.normalize_text(text))
+
+def _get_embedding_openai(text, client, model=QUERY_MODEL):
+    """Get embedding for query text using OpenAI (cached per normalized text)"""
+    key = _embedding_key(text, model)
+    emb = query_cache.get('embedding', key)
+    if emb is not None:
+        return emb
     try:
         response = client.embeddings.create(model=model, input=[text])
         emb = np.array(response.data[0].embedding, dtype='float32')
         # Normalize
         emb = emb / (np.linalg.norm(emb) + 1e-12)
+        query_cache.put('embedding', key, emb)
         return emb
     except Exception as e:
         print(f"Embedding error: {e}")
         return None
 
+def _dot_rows(matrix, vec, block=4096):
+    """matrix @ vec; float16 rows are upcast one block at a time, never all at once."""
+    if matrix.dtype == np.float32:
+        return np.dot(matrix, vec)
+    out = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], block):
+        out[start:start + block] = np.dot(matrix[start:start + block].astype(np.float32), vec)
+    return out
+
+def _top_k(scores, k):
+    """Indices of the k highest scores, best first: O(n) partition, then a sort of only k."""
+    n = len(scores)
+    k = max(0, min(int(k), n))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(scores, n - k)[n - k:]
+    return top[np.argsort(scores[top])[::-1]]
+
 def _search_segments(query_embedding, top_k=10):
     """Search for similar segments using numpy cosine similarity"""
-    global _embeddings, _keywords, _docs, _japan_map
-    
-    if _embeddings is None or query_embedding is None:
+    if _live is None or query_embedding is None:
         return []
+    embeddings, segments, projection, _ = _live  # one build for the whole query
+    
+    # Queries go through the same reduction as the stored vectors
+    if projection is not None:
+        query_embedding = projection.apply(query_embedding)
     
     # Compute cosine similarities (embeddings are already normalized)
-    similarities = np.dot(_embeddings, query_embedding)
+    similarities = _dot_rows(embeddings, query_embedding)
     
-    # Get top-k indices
-    top_indices = np.argsort(similarities)[::-1][:top_k]
+    # Get top-k indices (no full sort of the corpus)
+    top_indices = _top_k(similarities, top_k)
     
     results = []
     for idx in top_indices:
@@ -92,40 +169,217 @@ def _search_segments(query_embedding, top_k=10):
         # Convert cosine (-1 to 1) to match percentage (0 to 100)
         match_pct = round(max(0, min(1, (cosine + 1) / 2)) * 100, 1)
         
-        keyword = _keywords[idx] if _keywords and idx < len(_keywords) else f"segment_{idx}"
-        jp_name = _japan_map.get(keyword, keyword) if _japan_map else keyword
+        known = segments is not None and idx < len(segments)
+        keyword = segments.keyword(idx) if known else f"segment_{idx}"
         
         results.append({
-            'name': jp_name,
+            'name': segments.jp_name(idx) if known else keyword,
             'match_percent': match_pct,
             'keyword': keyword,
-            'text': _docs[idx].get('text', '') if _docs and idx < len(_docs) else ''
+            'text': segments.text(idx) if known else ''
         })
     
     return results
 
+# ------------------------------------
+# Retrieval only (/api/retrieve): same query building and selection as 12.py
+# ------------------------------------
+GEN_MODEL = os.environ.get('OPENAI_GEN_MODEL', 'gpt-4o-mini')
+
+def _has_japanese(text):
+    return any('\u3040' <= c <= '\u309F' or '\u30A0' <= c <= '\u30FF' or '\u4E00' <= c <= '\u9FAF'
+               for c in text or '')
+
+def _translate_ja_en(text, client, fallbacks=None):
+    """
+    Japanese -> English so the query lands in the (English) document space; short
+    text is kept. Translations go through query_cache; on failure the text is
+    returned as is and 'translation' is appended to `fallbacks`.
+    """
+    if not _has_japanese(text) or len(text.strip()) < 15:
+        return text
+    key = query_cache.cache_key('translation', 'ja-en', GEN_MODEL, text)
+    cached = query_cache.get('translation', key)
+    if cached is not None:
+        return cached
+    try:
+        resp = client.chat.completions.create(
+            model=GEN_MODEL,
+            messages=[{'role': 'system', 'content': 'Translate the following Japanese text to English. '
+                       'Keep the meaning accurate and preserve marketing/business terminology. '
+                       'Return ONLY the English translation.'},
+                      {'role': 'user', 'content': text}],
+            temperature=0.0, max_completion_tokens=500)
+        out = resp.choices[0].message.content.strip()
+        query_cache.put('translation', key, out)
+        return out
+    except Exception as e:
+        print(f"Translation failed: {e}")
+        if fallbacks is not None:
+            fallbacks.append('translation')
+        return text
+
+def _extract_keywords(brief, client, max_terms=20, fallbacks=None):
+    """
+    Up to max_terms distinct keywords from the brief (LLM; brief tokens if that
+    fails, noted as 'keywords' in `fallbacks`).
+    """
+    try:
+        resp = client.chat.completions.create(
+            model=GEN_MODEL,
+            messages=[{'role': 'system', 'content': f'Extract up to {max_terms} concise keywords (English and/or Japanese) '
+                       'from the campaign brief that are useful for matching Amazon audience/product segments. '
+                       'Return ONLY a JSON array of strings. Include both English and Japanese terms when relevant.'},
+                      {'role': 'user', 'content': brief}],
+            temperature=0.0, max_completion_tokens=220)
+        candidates = [x.strip() for x in json.loads(resp.choices[0].message.content.strip()) if isinstance(x, str)]
+    except Exception as e:
+        print(f"Keyword extraction failed, falling back: {e}")
+        if fallbacks is not None:
+            fallbacks.append('keywords')
+        candidates = [t for t in tokenize_lower(brief) if len(t) > 1]
+    out, seen = [], set()
+    for t in candidates:
+        if t and t.lower() not in seen:
+            seen.add(t.lower())
+            out.append(t)
+    return out[:max_terms]
+
+def _unit(v):
+    v = np.asarray(v, dtype='float32')
+    return v / (np.linalg.norm(v) + 1e-12)
+
+def _embed_query(brief, client, use_extract, kw_weight, projection, fallbacks=None):
+    """Brief (in English) blended with its keywords by kw_weight, in the index's vector space."""
+    ai_kws = _extract_keywords(brief, client, fallbacks=fallbacks) if use_extract else []
+    texts = [_translate_ja_en(brief, client, fallbacks)]
+    if ai_kws:
+        texts.append(_translate_ja_en(' | '.join(ai_kws), client, fallbacks))
+    keys = [_embedding_key(t) for t in texts]
+    vecs = [query_cache.get('embedding', k) for k in keys]
+    missing = [i for i, v in enumerate(vecs) if v is None]
+    if missing:
+        response = client.embeddings.create(model=QUERY_MODEL, input=[texts[i] for i in missing])
+        for i, d in zip(missing, sorted(response.data, key=lambda d: d.index)):
+            vecs[i] = _unit(d.embedding)
+            query_cache.put('embedding', keys[i], vecs[i])
+    q = vecs[0]
+    if len(vecs) > 1:
+        w = float(max(0.0, min(1.0, kw_weight)))
+        q = _unit((1.0 - w) * vecs[0] + w * vecs[1])
+    return (projection.apply(q) if projection is not None else q), ai_kws
+
+def _select_segments(embeddings, segments, q, top_k, min_cos):
+    """
+    Best top_k distinct keywords with cosine >= min_cos, as (ids, cosines).
+    Candidates grow from 2*top_k (doubling) until enough distinct keywords clear
+    min_cos or the weakest candidate is already below it; every score is
+    computed once, only the candidates are sorted.
+    """
+    scores = _dot_rows(embeddings, q)
+    n = len(scores)
+    k = min(n, max(top_k * 2, 16))
+    while True:
+        ids = _top_k(scores, k)
+        cos = scores[ids].astype('float64')  # float64 so scores match 12.py
+        above = cos >= min_cos
+        if k >= n or cos[-1] < min_cos or len(np.unique(segments.key_ids[ids[above]])) >= top_k:
+            break
+        k = min(n, k * 2)
+    # Each keyword keeps its best-ranked hit, then the threshold, then top_k
+    _, first = np.unique(segments.key_ids[ids], return_index=True)
+    keep = np.sort(first)
+    ids, cos = ids[keep], cos[keep]
+    above = cos >= min_cos
+    ids, cos = ids[above], cos[above]
+    order = np.argsort(-cos, kind='stable')[:top_k]
+    return ids[order], cos[order]
+
+def _retrieve(brief, client, top_k=10, kw_weight=0.4, min_cos=0.20, use_extract=True, base_ctr_pct=1.0,
+              fallbacks=None):
+    """
+    Rows shaped like Flask /api/retrieve segments (name, match_percent, cosine, hits, est_ctr_pct).
+    Steps that fell back after an error are appended to `fallbacks`.
+    """
+    embeddings, segments, projection, _ = _live  # one build for the whole query
+    if segments is None or len(segments) != len(embeddings):
+        raise RuntimeError('Segment data does not match the embeddings; rebuild the index bundle.')
+    q, ai_kws = _embed_query(brief, client, use_extract, kw_weight, projection, fallbacks)
+    ids, cos = _select_segments(embeddings, segments, q, top_k, min_cos)
+
+    query_terms = tokenize_lower(brief)
+    for kw in ai_kws:
+        query_terms |= tokenize_lower(kw)
+    query_ids = segments.terms.lookup(query_terms)
+
+    rows = []
+    for idx, c in zip(ids, cos):
+        hits = segments.terms.hits(int(idx), query_ids)
+        match_pct = max(0.0, min(1.0, (float(c) + 1.0) / 2.0)) * 100.0
+        # Same CTR heuristic as 12.py: base * (0.5 + 0.5 * match) * keyword-hit bonus (max 1.25)
+        est_ctr = base_ctr_pct * (0.5 + 0.5 * match_pct / 100.0) * min(1.25, 1.0 + 0.02 * len(hits))
+        rows.append({
+            'name': segments.jp_name(idx),
+            'match_percent': match_pct,
+            'keyword': segments.keyword(idx),
+            'cosine': float(c),
+            'hits': hits[:20],
+            'est_ctr_pct': round(est_ctr, 2)
+        })
+    return rows, ai_kws
+
+_GRAM = 4  # _get_related_keywords only matches words of 4+ characters
+
+def _build_keyword_index(japan_map):
+    """
+    (entries, lowercased keys, 4-gram -> entry positions) for japan.json.
+    Every 4-gram of a word occurs in any key containing it, so a word's
+    candidates are the posting list of its rarest 4-gram, in japan.json order.
+    """
+    entries = list(japan_map.items())
+    lowered = [k.lower() for k, _ in entries]
+    grams = {}
+    for i, key in enumerate(lowered):
+        for g in {key[j:j + _GRAM] for j in range(len(key) - _GRAM + 1)}:
+            grams.setdefault(g, []).append(i)
+    return entries, lowered, grams, {}
+
+def _entries_containing(word):
+    """japan.json (key, value) pairs whose lowercased key contains `word` (lowercase), in file order."""
+    entries, lowered, grams, cache = _keyword_index
+    hits = cache.get(word)
+    if hits is None:
+        if len(word) < _GRAM:
+            candidates = range(len(entries))
+        else:
+            postings = [grams.get(word[j:j + _GRAM], ()) for j in range(len(word) - _GRAM + 1)]
+            candidates = min(postings, key=len)
+        hits = cache[word] = [entries[i] for i in candidates if word in lowered[i]]
+    return hits
+
 def _get_related_keywords(english_key, japanese_name):
     """Find related keywords from japan.json"""
-    global _japan_map
+    global _japan_map, _keyword_index
     
     keywords = [japanese_name]
     
     # Simple substring matching to find related categories in Japanese
     # This is rudimentary but ensures keywords exist in japan.json
     if _japan_map:
+        if _keyword_index is None:
+            _keyword_index = _build_keyword_index(_japan_map)
         count = 0
         # Try to find other categories that contain parts of the English key
         parts = english_key.split()
         for part in parts:
             if len(part) < 4: continue # Skip short words
             
-            for k, v in _japan_map.items():
+            for k, v in _entries_containing(part.lower()):
                 if k == english_key: continue
-                if part.lower() in k.lower():
-                    if v not in keywords:
-                        keywords.append(v)
-                        count += 1
-                        if count >= 9: break
+                if v not in keywords:
+                    keywords.append(v)
+                    count += 1
+                    if count >= 9: break
             if count >= 9: break
             
     return keywords[:10]
@@ -172,7 +426,9 @@ class handler(BaseHTTPRequestHandler):
         self.end_headers()
         
         if self.path == '/api/health' or self.path == '/health':
-            response = {'status': 'ok', 'message': 'API is running on Vercel'}
+            response = {'status': 'ok', 'message': 'API is running on Vercel',
+                        'bundle': _live[3] if _live is not None else None,
+                        'cache': query_cache.stats()}
         else:
             # Check if OPENAI_API_KEY is set
             has_key = bool(os.environ.get('OPENAI_API_KEY'))
@@ -183,6 +439,7 @@ class handler(BaseHTTPRequestHandler):
                 'endpoints': {
                     'ui': 'GET /',
                     'health': 'GET /api/health',
+                    'retrieve': 'POST /api/retrieve',
                     'generate': 'POST /api/generate'
                 }
             }
@@ -234,12 +491,44 @@ class handler(BaseHTTPRequestHandler):
         if len(campaign_brief) < 10:
             return {'error': 'Campaign brief must be at least 10 characters'}
         
-        return {
-            'message': 'Segment retrieval requires faiss backend',
-            'note': 'Use local deployment for full vector search',
-            'segments': [],
-            'total_found': 0
+        top_k = int(data.get('top_k', 10))
+        if top_k < 1:
+            return {'error': 'top_k must be >= 1'}
+        
+        api_key = os.environ.get('OPENAI_API_KEY')
+        if not api_key:
+            return {'error': 'OPENAI_API_KEY not configured'}
+        
+        if not _load_search_data():
+            return {'error': _load_error or 'Search data not found; publish an index bundle first.'}
+        
+        params = {
+            'top_k': top_k,
+            'kw_weight': float(data.get('keyword_weight', data.get('kw_weight', 0.4))),
+            'min_cos': float(data.get('min_cos', 0.20)),
+            'use_extract': bool(data.get('enable_keywords', True))
+        }
+        # Same brief + parameters on the same bundle: reuse the response (no OpenAI calls)
+        cache_key = query_cache.cache_key('retrieve', query_cache.normalize_text(campaign_brief),
+                                          params, QUERY_MODEL, GEN_MODEL, _live[3])
+        cached = query_cache.get('retrieve', cache_key)
+        if cached is not None:
+            return cached
+        
+        from openai import OpenAI
+        client = OpenAI(api_key=api_key)
+        fallbacks = []
+        segments, ai_keywords = _retrieve(campaign_brief, client, fallbacks=fallbacks, **params)
+        response = {
+            'segments': segments,
+            'ai_keywords': ai_keywords,
+            'top_k': top_k,
+            'bundle': _live[3],
+            'total_found': len(segments)
         }
+        if not fallbacks:  # a degraded query (OpenAI error) is not kept for the whole TTL
+            query_cache.put('retrieve', cache_key, response)
+        return response
     
     def _handle_generate(self, data):
         try:
@@ -261,13 +550,24 @@ class handler(BaseHTTPRequestHandler):
             except ImportError as e:
                 return {'error': f'OpenAI import failed: {str(e)}'}
             
-            client = OpenAI(api_key=api_key)
-            model = os.environ.get('OPENAI_GEN_MODEL', 'gpt-4o-mini')
             top_k = int(data.get('top_k', 10))
+            has_data = _load_search_data()
+            if not has_data and _load_error:
+                # e.g. the bundle was embedded with another model: scores would be meaningless
+                return {'error': _load_error}
+            
+            # Same brief + top_k on the same bundle: reuse the whole response
+            cache_key = query_cache.cache_key('generate', query_cache.normalize_text(campaign_brief), top_k,
+                                              QUERY_MODEL, _live[3] if has_data else None)
+            cached = query_cache.get('generate', cache_key)
+            if cached is not None:
+                return cached
+            
+            client = OpenAI(api_key=api_key)
             
             # --- Vector Search for real match percentages ---
             segments_with_score = []
-            if _load_search_data():
+            if has_data:
                 # Get query embedding
                 query_emb = _get_embedding_openai(campaign_brief, client)
                 if query_emb is not None:
@@ -291,11 +591,14 @@ class handler(BaseHTTPRequestHandler):
                         'keywords': segment_keywords
                     })
             
-            return {
+            response = {
                 'segments': segments_with_score,  # Real scores from vector search
                 'generated_segments': generated_segments,
                 'total_found': len(segments_with_score)
             }
+            if segments_with_score:  # an empty result may be a transient embedding failure
+                query_cache.put('generate', cache_key, response)
+            return response
             
         except Exception as e:
             return {
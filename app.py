@@ -1,15 +1,17 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 import os
-import sys
 import json
-import subprocess
 import re
+import threading
+import importlib.util
 import httpx
 from packaging import version
 from openai import OpenAI
 
+from utils.translation_cache import get_cached, put_cached
+
 # ---------------------------------------
 # HTTPX client + OpenAI client (proxy-safe)
 # ---------------------------------------
@@ -87,6 +89,12 @@ def translate_keywords_to_japanese(keywords: list[str]) -> list[str]:
         print("No keywords to translate")  # Debug
         return keywords
 
+    model = os.getenv("OPENAI_GEN_MODEL", "gpt-4o-mini")
+    cache_text = json.dumps(keywords, ensure_ascii=False)
+    cached = get_cached("kw2ja", model, cache_text)
+    if cached is not None:
+        return json.loads(cached)
+
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         print("No OpenAI API key found")  # Debug
@@ -98,7 +106,6 @@ def translate_keywords_to_japanese(keywords: list[str]) -> list[str]:
         print(f"OpenAI client init error: {e}")
         return keywords
 
-    model = os.getenv("OPENAI_GEN_MODEL", "gpt-4o-mini")
     keywords_text = ", ".join(keywords)
     print(f"Translating keywords: {keywords_text}")  # Debug
 
@@ -122,6 +129,7 @@ def translate_keywords_to_japanese(keywords: list[str]) -> list[str]:
         translated = json.loads(content)
         if isinstance(translated, list) and len(translated) == len(keywords):
             print(f"Successfully translated to: {translated}")  # Debug
+            put_cached("kw2ja", model, cache_text, json.dumps(translated, ensure_ascii=False))
             return translated
         else:
             print(f"Translation format error: expected {len(keywords)} items, got {len(translated) if isinstance(translated, list) else 'not a list'}")  # Debug
@@ -132,6 +140,30 @@ def translate_keywords_to_japanese(keywords: list[str]) -> list[str]:
     print("Falling back to original keywords")  # Debug
     return keywords
 
+# ---------------------------------------
+# Retrieval engine (12.py loaded in-process, once)
+# ---------------------------------------
+ENGINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '12.py')
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """
+    Import 12.py as a module and load its FAISS index + docs once per process.
+    Its OpenAI client and translation cache are then shared by every request.
+    """
+    global _engine
+    if _engine is not None:
+        return _engine
+    with _engine_lock:
+        if _engine is None:
+            spec = importlib.util.spec_from_file_location('segment_engine', ENGINE_PATH)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            module.load_index()
+            _engine = module
+    return _engine
+
 # ---------------------------------------
 # Flask app
 # ---------------------------------------
@@ -152,6 +184,43 @@ if missing_env:
 def index():
     return send_from_directory('public', 'index.html')
 
+# ---------------------------------------
+# Response shaping (from 12.py's structured result)
+# ---------------------------------------
+def rows_to_segments(rows):
+    """Map engine rows to API segments; name/match_percent are what the UI reads."""
+    return [{
+        'name': r['jp_name'],
+        'match_percent': r['match_pct'],
+        'keyword': r['keyword'],
+        'cosine': r['cosine'],
+        'hits': r['hits'],
+        'est_ctr_pct': r['est_ctr_pct']
+    } for r in rows]
+
+def generation_to_segments(generation):
+    """Map validated generation objects to API segments, translating any English keywords."""
+    segments = []
+    for item in generation or []:
+        keywords = item['keywords']
+        # Only translate if keywords are in English
+        if keywords and any(re.search(r'[a-zA-Z]', kw) for kw in keywords):
+            keywords = translate_keywords_to_japanese(keywords)
+        segments.append({
+            'name': item['segment_name'],
+            'why_fits': item['why_it_fits'],
+            'keywords': keywords
+        })
+    return segments
+
+def _read_request_params(data):
+    return {
+        'brief': data.get('campaign_brief', '').strip(),
+        'top_k': int(data.get('top_k', 10)),
+        'kw_weight': float(data.get('keyword_weight', 0.4)),
+        'use_extract': bool(data.get('enable_keywords', True))
+    }
+
 # ---------------------------------------
 # API: retrieval only
 # ---------------------------------------
@@ -161,10 +230,8 @@ def retrieve_segments():
         data = request.json
         print(f"Received data: {data}")
 
-        campaign_brief = data.get('campaign_brief', '').strip()
-        top_k = int(data.get('top_k', 10))
-        keyword_weight = float(data.get('keyword_weight', 0.4))
-        enable_keywords = data.get('enable_keywords', True)
+        params = _read_request_params(data)
+        campaign_brief = params['brief']
 
         if not campaign_brief:
             return jsonify({'error': 'Campaign brief is required'}), 400
@@ -176,34 +243,16 @@ def retrieve_segments():
         "error": f"キャンペーン説明が短すぎます。最低 {MIN_BRIEF_CHARS} 文字必要です。"
         }), 400
 
+        result = get_engine().run_pipeline(retrieval_only=True, **params)
+        if result['error']:
+            return jsonify({'error': result['error']}), 500
 
-        # Build command for 12.py
-        cmd = [
-            sys.executable, '12.py',
-            '--brief', campaign_brief,
-            '--kw-weight', str(keyword_weight),
-            '--retrieval-only'  # Only get matches, no LLM generation
-        ]
-        if not enable_keywords:
-            cmd.append('--no-extract')
-
-        print(f"Running command: {' '.join(cmd)}")
-
-        # Run the script
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd='.')
-
-        print(f"Return code: {result.returncode}")
-        print(f"STDOUT: {result.stdout}")
-        print(f"STDERR: {result.stderr}")
-
-        if result.returncode != 0:
-            return jsonify({'error': f'Script error: {result.stderr}'}), 500
-
-        # Parse the output from 12.py
-        segments = parse_retrieval_output(result.stdout)
-
+        segments = rows_to_segments(result['rows'])
         return jsonify({
             'segments': segments,
+            'ai_keywords': result['ai_keywords'],
+            'top_k': result['top_k'],
+            'search_stats': result['search_stats'],
             'total_found': len(segments)
         })
 
@@ -220,41 +269,25 @@ def generate_segments():
         data = request.json
         print(f"Generate received data: {data}")
 
-        campaign_brief = data.get('campaign_brief', '').strip()
-        top_k = int(data.get('top_k', 10))
-        keyword_weight = float(data.get('keyword_weight', 0.4))
-        enable_keywords = data.get('enable_keywords', True)
+        params = _read_request_params(data)
 
-        if not campaign_brief:
+        if not params['brief']:
             return jsonify({'error': 'Campaign brief is required'}), 400
 
-        # Build command for 12.py (without --retrieval-only for full generation)
-        cmd = [
-            sys.executable, '12.py',
-            '--brief', campaign_brief,
-            '--kw-weight', str(keyword_weight)
-        ]
-        if not enable_keywords:
-            cmd.append('--no-extract')
-
-        print(f"Running generate command: {' '.join(cmd)}")
-
-        # Run the script
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd='.')
-
-        print(f"Generate return code: {result.returncode}")
-        print(f"Generate STDOUT: {result.stdout}")
-        print(f"Generate STDERR: {result.stderr}")
-
-        if result.returncode != 0:
-            return jsonify({'error': f'Script error: {result.stderr}'}), 500
-
-        # Parse both retrieval results and generated segments
-        segments, generated_segments = parse_full_output(result.stdout, campaign_brief)
+        result = get_engine().run_pipeline(**params)
+        if result['error']:
+            return jsonify({'error': result['error']}), 500
+        if result['generation_error']:
+            print(f"Generation failed: {result['generation_error']}")
 
+        segments = rows_to_segments(result['rows'])
         return jsonify({
             'segments': segments,
-            'generated_segments': generated_segments,
+            'generated_segments': generation_to_segments(result['generation']),
+            'generation_error': result['generation_error'],
+            'ai_keywords': result['ai_keywords'],
+            'top_k': result['top_k'],
+            'search_stats': result['search_stats'],
             'total_found': len(segments)
         })
 
@@ -263,178 +296,57 @@ def generate_segments():
         return jsonify({'error': str(e)}), 500
 
 # ---------------------------------------
-# Parsing helpers
+# API: streaming generate (Server-Sent Events)
 # ---------------------------------------
-def parse_retrieval_output(output):
-    """Parse the retrieval-only output from 12.py"""
-    segments = []
-    lines = output.split('\n')
-
-    for i, line in enumerate(lines):
-        # Look for lines like: "1) Tech Enthusiasts 25-34 (75.2%)" or "1) Tech Enthusiasts 25-34"
-        match = re.match(r'(\d+)\)\s+(.+?)(?:\s*\(([\d.]+)%\))?\s*$', line.strip())
-        if match:
-            segment_name = match.group(2)
-            match_percent = float(match.group(3)) if match.group(3) else None
-            
-            # If no percentage in the line, look for it in the next line
-            if match_percent is None and i + 1 < len(lines):
-                score_line = lines[i + 1]
-                # Parse various formats: "match: 89.1%" or "• match: 89.1%"
-                score_match = re.search(r'match:\s*([\d.]+)%', score_line)
-                if score_match:
-                    match_percent = float(score_match.group(1))
-
-            # Add segment even if no percentage found (for compatibility)
-            japanese_segment_name = get_japanese_name(segment_name)
-            segments.append({
-                'name': japanese_segment_name,
-                'match_percent': match_percent or 0.0
-            })
-    return segments
-
-def parse_full_output(output, brief=""):
-    """Parse both retrieval results and generated segments from full 12.py output"""
-    # Split output into retrieval and generation parts
-    parts = output.split('💡 Proposed Target Segments')
-
-    # Parse retrieval part
-    segments = parse_retrieval_output(parts[0])
-
-    # Parse generated segments
-    generated_segments = []
-    if len(parts) > 1:
-        generated_segments = parse_generated_segments(parts[1], brief)
-
-    return segments, generated_segments
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
-def parse_generated_segments(output_text, brief=""):
-    """Parse the generated segments from JSON output"""
-    segments = []
-
-    print(f"Parsing output text: {output_text[:500]}...")  # Debug
-
-    # Try to parse as JSON first (new format)
-    try:
-        # Look for JSON array in the output
-        json_match = re.search(r'\[[\s\S]*\]', output_text)
-        if json_match:
-            json_text = json_match.group(0)
-            data = json.loads(json_text)
-            
-            print(f"Found JSON with {len(data)} segments")  # Debug
-            
-            for item in data:
-                if isinstance(item, dict):
-                    segment = {
-                        'name': item.get('segment_name', ''),
-                        'why_fits': item.get('why_it_fits', ''),
-                        'keywords': item.get('keywords', [])
-                    }
-                    segments.append(segment)
-                    print(f"Parsed JSON segment: {segment['name']}")  # Debug
-            
-            return segments
-    except Exception as e:
-        print(f"JSON parsing failed: {e}, trying markdown fallback")  # Debug
-
-    # Fallback to markdown parsing (old format)
-    segment_blocks = re.split(r'\*\*Segment \d+:', output_text)
-    print(f"Found {len(segment_blocks)} markdown blocks")  # Debug
-
-    for i, block in enumerate(segment_blocks[1:], 1):  # Skip first empty part
-        print(f"Processing markdown block {i}: {block[:200]}...")  # Debug
-
-        segment = {}
-
-        # Extract segment name (first line after the segment marker)
-        lines = block.strip().split('\n')
-        if lines:
-            name_line = lines[0].strip().replace('**', '').strip()
-            if name_line:
-                segment['name'] = name_line
-
-        # Extract "Why it fits"
-        why_match = re.search(r'\*\*Why it fits:\*\*\s*([^\*]+?)(?=\*\*|$)', block, re.DOTALL)
-        if why_match:
-            segment['why_fits'] = why_match.group(1).strip()
-
-        # Extract keywords - handle both comma-separated and bullet format
-        keywords_match = re.search(r'\*\*Keywords:\*\*\s*([^\*]+?)(?=\*\*|$)', block, re.DOTALL)
-        if keywords_match:
-            keywords_text = keywords_match.group(1).strip()
-            # Try Japanese comma first, then regular comma
-            keywords = [kw.strip() for kw in keywords_text.split('、') if kw.strip()]
-            if len(keywords) <= 1:
-                keywords = [kw.strip() for kw in keywords_text.split(',') if kw.strip()]
-            # If no commas, try bullet points
-            if len(keywords) <= 1:
-                keywords = re.findall(r'[•·-]\s*([^\n]+)', keywords_text)
-                keywords = [kw.strip() for kw in keywords if kw.strip()]
-            
-            print(f"Original markdown keywords: {keywords}")  # Debug
-
-            # Only translate if keywords are in English
-            if keywords and any(re.search(r'[a-zA-Z]', kw) for kw in keywords):
-                try:
-                    japanese_keywords = translate_keywords_to_japanese(keywords)
-                    print(f"Translated keywords: {japanese_keywords}")  # Debug
-                    segment['keywords'] = japanese_keywords
-                except Exception as e:
-                    print(f"Keyword translation failed: {e}")
-                    segment['keywords'] = keywords
-            else:
-                segment['keywords'] = keywords
-
-        print(f"Parsed markdown segment: {segment}")  # Debug
-
-        # Only add segment if it has essential fields
-        if segment.get('name') and (segment.get('why_fits') or segment.get('keywords')):
-            segments.append(segment)
-
-    print(f"Final parsed segments: {segments}")  # Debug
-    
-    # If no segments were parsed, try alternative parsing
-    if not segments:
-        print("No segments found with standard parsing, trying alternative method...")
-        segments = parse_segments_alternative(output_text)
-    
-    return segments
-
-def parse_segments_alternative(markdown_text):
-    """Alternative parsing method for generated segments"""
-    segments = []
-    
-    # Look for any text that looks like segment names
-    lines = markdown_text.split('\n')
-    current_segment = {}
-    
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-            
-        # Look for segment names (usually after "Segment N:" or as headers)
-        if re.match(r'.*セグメント.*:|.*Segment.*:', line) or line.startswith('**') and line.endswith('**'):
-            if current_segment.get('name'):
-                segments.append(current_segment)
-            current_segment = {'name': re.sub(r'\*\*|Segment \d+:\s*', '', line).strip()}
-        elif 'なぜ適合' in line or 'Why it fits' in line:
-            # Extract reason
-            reason = re.sub(r'\*\*.*?\*\*\s*', '', line).strip()
-            if reason:
-                current_segment['why_fits'] = reason
-        elif 'キーワード' in line or 'Keywords' in line:
-            # Extract keywords from next few lines
-            keywords = re.findall(r'[^\s,]+', line.replace('キーワード', '').replace('Keywords', '').replace('**', '').replace(':', ''))
-            if keywords:
-                current_segment['keywords'] = keywords[:10]
-    
-    # Add the last segment
-    if current_segment.get('name'):
-        segments.append(current_segment)
-    
-    return segments
+@app.route('/api/generate/stream', methods=['POST'])
+def generate_segments_stream():
+    """
+    /api/generate as text/event-stream:
+      retrieval  {segments, ai_keywords, top_k, search_stats, total_found}  once the search is done
+      segment    {index, segment}  each generated segment as soon as the model completes it
+      done       {generation_error, total_generated}; with an error, discard the segments
+                 sent so far (like /api/generate, which returns none when generation fails)
+      error      {error}  retrieval failed (or the request was invalid); the stream ends
+    """
+    data = request.json or {}
+    print(f"Generate (stream) received data: {data}")
+    params = _read_request_params(data)
+
+    def events():
+        if not params['brief']:
+            yield _sse('error', {'error': 'Campaign brief is required'})
+            return
+        try:
+            generated = 0
+            for kind, payload in get_engine().run_pipeline_stream(**params):
+                if kind == 'retrieval':
+                    if payload['error']:
+                        yield _sse('error', {'error': payload['error']})
+                        return
+                    segments = rows_to_segments(payload['rows'])
+                    yield _sse('retrieval', {
+                        'segments': segments,
+                        'ai_keywords': payload['ai_keywords'],
+                        'top_k': payload['top_k'],
+                        'search_stats': payload['search_stats'],
+                        'total_found': len(segments)
+                    })
+                elif kind == 'segment':
+                    yield _sse('segment', {'index': generated, 'segment': generation_to_segments([payload])[0]})
+                    generated += 1
+                else:
+                    if payload['generation_error']:
+                        print(f"Generation failed: {payload['generation_error']}")
+                    yield _sse('done', {'generation_error': payload['generation_error'], 'total_generated': generated})
+        except Exception as e:
+            print(f"Generate (stream) error: {e}")
+            yield _sse('error', {'error': str(e)})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # ---------------------------------------
 # Healthcheck
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_search.py
+Cold start + per-query latency of the serverless (numpy) search path in api/index.py,
+against the previous approach.
+
+  before  compressed embeddings.npz: decompress + astype + renormalize at load,
+          full np.argsort of all scores per query
+  after   pre-normalized raw vectors.npy memory-mapped at load,
+          argpartition + sort of k per query (api/index.py `_top_k`)
+
+Cold start is load + the first query (mmap pays its page reads there).
+Both variants read from the OS page cache after the first run, like a warm
+Vercel instance's disk; the difference is decompression/normalization work.
+
+Usage:
+  python bench_search.py                      # vectors of the live serverless bundle
+  python bench_search.py --synthetic 200000x384
+  python bench_search.py --vectors path/to/vectors.npy --queries 500 --k 10
+"""
+
+import os, sys, time, argparse, tempfile, statistics, importlib.util
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+from utils.bundle import SERVERLESS, bundle_file, bundle_root, load_bundle
+
+def _load_api():
+    # api/index.py is a Vercel handler file, not a package module
+    spec = importlib.util.spec_from_file_location("api_index", os.path.join(BASE_DIR, "api", "index.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _source_vectors(args) -> np.ndarray:
+    if args.synthetic:
+        n, dim = (int(x) for x in args.synthetic.lower().split("x"))
+        vecs = np.random.default_rng(0).standard_normal((n, dim)).astype("float32")
+        return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+    path = args.vectors
+    if not path:
+        bundle = load_bundle(bundle_root(os.path.join(BASE_DIR, "Data"), SERVERLESS))
+        path = bundle_file(bundle, "vectors") if bundle else os.path.join(BASE_DIR, "Data", "embeddings.npy")
+    if not os.path.exists(path):
+        sys.exit(f"❌ No vectors at {path} (build a bundle first, or use --synthetic NxDIM)")
+    return np.load(path, mmap_mode="r")
+
+# -------------------------------
+# Variants
+# -------------------------------
+def load_before(npz_path: str) -> np.ndarray:
+    data = np.load(npz_path)
+    emb = data["embeddings"].astype("float32")
+    return emb / (np.linalg.norm(emb, axis=1, keepdims=True) + 1e-12)
+
+def search_before(emb: np.ndarray, q: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(np.dot(emb, q))[::-1][:k]
+
+def load_after(npy_path: str) -> np.ndarray:
+    return np.load(npy_path, mmap_mode="r")
+
+def _time_ms(fn, *a) -> float:
+    t0 = time.perf_counter()
+    fn(*a)
+    return (time.perf_counter() - t0) * 1000.0
+
+def run(label: str, load, search, path: str, queries: np.ndarray, k: int, repeats: int) -> dict:
+    cold = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        emb = load(path)
+        load_ms = (time.perf_counter() - t0) * 1000.0
+        first_ms = _time_ms(search, emb, queries[0], k)
+        cold.append((load_ms, first_ms))
+        del emb
+    emb = load(path)
+    per_query = [_time_ms(search, emb, q, k) for q in queries]
+    load_ms = statistics.median(c[0] for c in cold)
+    first_ms = statistics.median(c[1] for c in cold)
+    row = {"variant": label, "load_ms": load_ms, "cold_start_ms": load_ms + first_ms,
+           "query_p50_ms": statistics.median(per_query),
+           "query_p95_ms": float(np.percentile(per_query, 95))}
+    print(f"   {label:<7} load={row['load_ms']:8.2f} ms  cold start={row['cold_start_ms']:8.2f} ms  "
+          f"query p50={row['query_p50_ms']:7.3f} ms  p95={row['query_p95_ms']:7.3f} ms")
+    return row
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the serverless search path (cold start + per query)")
+    ap.add_argument("--vectors", default="", help="A vectors .npy (default: the live bundle's).")
+    ap.add_argument("--synthetic", default="", help="Random normalized vectors instead, e.g. 200000x384.")
+    ap.add_argument("--queries", type=int, default=200, help="Queries for the per-query latency.")
+    ap.add_argument("--k", type=int, default=10, help="top_k per query.")
+    ap.add_argument("--repeats", type=int, default=5, help="Cold starts per variant (median is reported).")
+    args = ap.parse_args()
+
+    api = _load_api()
+    vecs = _source_vectors(args)
+    n, dim = vecs.shape
+    rng = np.random.default_rng(1)
+    queries = np.asarray(vecs[rng.integers(0, n, args.queries)], dtype="float32")
+    queries += rng.normal(0, 0.05, queries.shape).astype("float32")  # near, not identical, to a doc
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    def search_after(emb, q, k):
+        return api._top_k(api._dot_rows(emb, q), k)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        npz_path, npy_path = os.path.join(tmp, "embeddings.npz"), os.path.join(tmp, "vectors.npy")
+        np.savez_compressed(npz_path, embeddings=np.asarray(vecs))
+        np.save(npy_path, np.asarray(vecs, dtype="float32"))
+
+        print(f"⏱️ Serverless search path: {n} vectors x {dim} dims, k={args.k}, {args.queries} queries")
+        before = run("before", load_before, search_before, npz_path, queries, args.k, args.repeats)
+        after = run("after", load_after, search_after, npy_path, queries, args.k, args.repeats)
+
+    # compare scores, not ids: tied docs may come back in either order
+    full = np.asarray(vecs, dtype="float32")
+    same = all(np.allclose(full[search_before(full, q, args.k)] @ q, full[search_after(full, q, args.k)] @ q)
+               for q in queries[:20])
+    print(f"📊 cold start {before['cold_start_ms'] / max(after['cold_start_ms'], 1e-9):.1f}x faster, "
+          f"query p50 {before['query_p50_ms'] / max(after['query_p50_ms'], 1e-9):.1f}x faster "
+          f"(same top-k: {'yes' if same else 'NO'})")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,27 @@
 #!/usr/bin/env python3
 """
 Create pre-computed embeddings for all documents in docs.jsonl
-Output: Data/embeddings.npz (numpy compressed format)
+Output: Data/bundles/serverless/<version>/ (see utils/bundle.py), published as its CURRENT:
+          vectors.npy (L2-normalized, raw; api/index.py memory-maps it)
+          docs.jsonl + docs.store/ (segment columns, see utils/segment_store.py)
+          keywords.json, proj.npz (--dim), bundle.json (model fingerprint + build stats)
+        Data/embeddings.npz (legacy compressed format, only with --npz)
+
+  --dtype float16 halves the stored (and serverless in-memory) vectors;
+  api/index.py searches float16 matrices without upcasting them whole.
+  Docs are streamed and embedded in --chunk-size chunks straight to
+  Data/embeddings.vectors.f32, with a checkpoint after each chunk so a failed
+  run resumes. Only new or changed docs are embedded (embeddings.manifest.jsonl,
+  see utils/vector_manifest.py); --full re-embeds all. --workers N runs N
+  local (FastEmbed) embedding processes.
+  --dim N (--reduce pca|truncate) stores N-dim vectors plus the projection
+  (proj.npz) that api/index.py applies to queries.
 """
+import argparse
 import json
 import numpy as np
 import os
+import shutil
 import sys
 from dotenv import load_dotenv
 
@@ -14,42 +30,112 @@ load_dotenv()  # Load .env file
 # Add parent dir to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from utils.embedding import get_embeddings_batch
+from utils.embedding import throughput_report, model_fingerprint, bulk_chunk_size
+from utils.vector_manifest import VectorManifest, Checkpoint
+from utils.segment_store import write_store
+from utils.projection import Projection, DIM, METHOD
+from utils.bundle import SERVERLESS, BundleBuilder, bundle_root, write_vectors
+
+def _iter_chunks(docs_path, size, skip=0):
+    """(keywords, texts) per chunk of docs.jsonl lines, streamed."""
+    keys, texts = [], []
+    with open(docs_path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if i < skip:
+                continue
+            doc = json.loads(line)
+            keys.append(doc.get('keyword', ''))
+            # Combine keyword and text for better embedding
+            texts.append(f"{doc.get('keyword', '')} {doc.get('text', '')}")
+            if len(texts) >= size:
+                yield keys, texts
+                keys, texts = [], []
+    if texts:
+        yield keys, texts
 
 def main():
+    ap = argparse.ArgumentParser(description="Pre-compute embeddings for the serverless search path")
+    ap.add_argument("--full", action="store_true", help="Re-embed every doc instead of reusing unchanged vectors.")
+    ap.add_argument("--dtype", choices=["float32", "float16"], default="float32", help="Stored vector precision.")
+    ap.add_argument("--chunk-size", type=int, default=512, help="Docs per embedded/checkpointed chunk (raised to workers x batch).")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="Local embedding processes (EMBEDDING_BACKEND=local; default EMBEDDING_WORKERS or 1).")
+    ap.add_argument("--dim", type=int, default=DIM, help="Stored dimension (0 = full width; default EMBEDDING_DIM).")
+    ap.add_argument("--reduce", choices=["pca", "truncate"], default=METHOD, help="Reduction used for --dim.")
+    ap.add_argument("--npz", action="store_true", help="Also write the legacy compressed embeddings.npz (loads all vectors).")
+    args = ap.parse_args()
+
     docs_path = "Data/docs.jsonl"
     output_path = "Data/embeddings.npz"
     
-    # Load documents
-    print(f"Loading documents from {docs_path}...")
-    docs = []
-    with open(docs_path, "r", encoding="utf-8") as f:
-        for line in f:
-            docs.append(json.loads(line))
-    
-    print(f"Loaded {len(docs)} documents")
-    
-    # Prepare texts for embedding
-    texts = []
-    for doc in docs:
-        # Combine keyword and text for better embedding
-        text = f"{doc.get('keyword', '')} {doc.get('text', '')}"
-        texts.append(text)
+    manifest = VectorManifest(output_path, full=args.full)
+    checkpoint = Checkpoint(output_path, docs_path)
+    state = checkpoint.load()
+    if state and state.get("full") != args.full:
+        state = None
+    done = state["items"] if manifest.open(state["manifest"] if state else None) else 0
+    if done:
+        print(f"Resuming after {done} documents ({checkpoint.path})")
     
-    # Get embeddings in batches
-    print("Computing embeddings (this may take a few minutes)...")
-    embeddings = get_embeddings_batch(texts, batch_size=64)
+    # Stream documents and embed them chunk by chunk
+    print(f"Computing embeddings from {docs_path} (this may take a few minutes)...")
+    chunk_size = bulk_chunk_size(args.chunk_size, batch_size=64, workers=args.workers)  # keep every worker busy
+    for keys, texts in _iter_chunks(docs_path, chunk_size, skip=done):
+        manifest.add(keys, texts, batch_size=64, workers=args.workers)
+        done += len(texts)
+        checkpoint.save({"items": done, "full": args.full, "manifest": manifest.position()})
+        print(f"  {done} documents ({manifest.embedded} embedded, {manifest.reused} reused)")
+    embeddings = manifest.commit()
+    print(f"Reused {manifest.reused}, embedded {manifest.embedded}, dropped {manifest.removed}")
+    print(f"Throughput: {throughput_report()}")
     
-    print(f"Embeddings shape: {embeddings.shape}")
+    stats = {"docs": int(manifest.rows), "embedded": int(manifest.embedded), "reused": int(manifest.reused),
+             "removed": int(manifest.removed), "throughput": throughput_report(), "dtype": args.dtype}
     
-    # Save to npz file
-    print(f"Saving to {output_path}...")
-    np.savez_compressed(output_path, embeddings=embeddings)
+    # One versioned bundle: vectors + docs + projection + fingerprint, published atomically
+    builder = BundleBuilder(bundle_root("Data", SERVERLESS))  # api/index.py serves this root
+    try:
+        projection = None
+        if args.dim and args.dim < embeddings.shape[1]:
+            projection = Projection.fit(embeddings, args.dim, args.reduce)
+            projection.save(builder.path("projection", "proj.npz"))
+            print(f"Reduced to {args.dim} dims ({args.reduce})")
+        full_dim = int(embeddings.shape[1])
+        # Raw normalized vectors: np.load(mmap_mode="r") maps them with no decompression or renormalizing
+        print(f"Saving to {builder.dir} (vectors + segment store)...")
+        embeddings = write_vectors(builder.path("vectors", "vectors.npy"), embeddings, dtype=args.dtype,
+                                   projection=projection)
+        print(f"Embeddings shape: {embeddings.shape} ({args.dtype}, "
+              f"{embeddings.shape[0] * embeddings.shape[1] * np.dtype(args.dtype).itemsize / 1e6:.1f} MB)")
+        
+        # Docs are copied, not linked: Data/docs.jsonl may be edited in place later
+        bundle_docs = builder.path("docs", "docs.jsonl")
+        shutil.copyfile(docs_path, bundle_docs)
+        write_store(bundle_docs)
+        builder.files["docs_store"] = "docs.store"
+        
+        # Also save keywords for reference (streamed, one entry at a time)
+        with open(docs_path, "r", encoding="utf-8") as src, \
+                open(builder.path("keywords", "keywords.json"), "w", encoding="utf-8") as f:
+            f.write("[")
+            for i, line in enumerate(src):
+                f.write((", " if i else "") + json.dumps(json.loads(line).get('keyword', ''), ensure_ascii=False))
+            f.write("]")
+        
+        fingerprint = {"kind": SERVERLESS, "model": model_fingerprint(), "embedding_dim": full_dim, "dim": int(embeddings.shape[1]),
+                       "projection": projection.describe() if projection is not None else None}
+        bundle_dir = builder.publish(fingerprint, stats)
+    except BaseException:
+        builder.discard()
+        raise
+    print(f"Published bundle {builder.version} → {bundle_dir}")
     
-    # Also save keywords for reference
-    keywords = [doc.get('keyword', '') for doc in docs]
-    with open("Data/keywords.json", "w", encoding="utf-8") as f:
-        json.dump(keywords, f, ensure_ascii=False)
+    if args.npz:
+        print(f"Saving to {output_path}...")
+        # normalized=True tells api/index.py not to renormalize at load
+        np.savez_compressed(output_path, embeddings=np.asarray(embeddings).astype(args.dtype),
+                            normalized=np.array(True))
+    checkpoint.clear()
     
     print("Done!")
 
@@ -9,20 +9,67 @@ Build a cosine-similarity FAISS index from keyword_with_answer.json.
   2) [{"keyword": "...", "answer": "..."}, ...]
 - Embeds "Keyword: <k>\\nText: <answer>" so both fields influence retrieval
 - L2-normalizes embeddings and uses Inner Product (cosine)
+- Index type is chosen at build time (--index-type):
+    flat  exhaustive IndexFlatIP (default)
+    hnsw  graph index (--hnsw-m, --hnsw-ef-construction, --hnsw-ef-search)
+    ivf   IVF-Flat with trained centroids (--ivf-nlist, --ivf-nprobe)
+- Vector storage is chosen independently (--storage):
+    float32 (default) | float16 | sq8 (8-bit scalar quantizer) | pq (--pq-m, --pq-nbits)
+    (hnsw + pq is rejected: FAISS builds HNSW_PQ with the L2 metric)
+  Compressed codes can be rescored (--rescore fp16|flat) with --rescore-k-factor
+  times more candidates.
+  The type, storage and parameters are recorded in the bundle's meta.json, together
+  with index memory and a recall@k vs. latency report against the exact float32
+  baseline (non-flat types or compressed storage, or --benchmark). The report
+  also compares scores with exact cosines and fails the build on a mismatch.
+- Optional localization stage (--localize / --localize-only) stores `text_ja`
+  and `snippet_ja` (first 420 chars, as used by the generation prompt) per doc,
+  so 12.py builds prompts without translation calls at request time.
+  Runs in resumable chunks: progress is written back after every chunk.
+- Streaming: the source is parsed one member at a time and embedded in
+  --chunk-size chunks; vectors go straight to faiss2.vectors.f32 and docs to a
+  temp JSONL, so peak memory does not grow with the catalog (beyond the FAISS
+  index itself). A checkpoint (faiss2.build.json) after every chunk lets a
+  failed run resume where it stopped. With EMBEDDING_BACKEND=local, --workers N
+  shards each chunk across N embedding processes; texts/sec is reported.
+- Incremental: faiss2.manifest.jsonl records (keyword, text hash) per vector row
+  under the embedding model (utils/vector_manifest.py). Only new or changed docs
+  are embedded; the index is rebuilt from the vectors and swapped in
+  atomically. --full re-embeds everything.
+- Reduced dimension (--dim N, --reduce pca|truncate): the index is built from
+  vectors projected to N dims (utils/projection.py); the projection is saved
+  in the bundle (proj.npz) and queries are projected through it. The manifest keeps
+  full-width vectors, so changing --dim never re-embeds. --bench-dims 64,128,...
+  records recall@k vs. dimension against full-width exact search.
+- Bundles: bundle.json records the embedding model/backend, dimensions and
+  build stats. Servers refuse a bundle whose model differs from their query
+  model and swap to a newly published bundle without a restart.
+  --localize publishes a new bundle with the localized docs.
 
 Env:
   EMBEDDING_BACKEND=openai|local
   EMBEDDING_MODEL=...   (e.g., text-embedding-3-small or BAAI/bge-small-en-v1.5)
+  OPENAI_GEN_MODEL=...  (translation model for --localize; same as 12.py)
 
-Outputs:
-  data/faiss.index
-  data/docs.jsonl
+Outputs (one versioned bundle per build, see utils/bundle.py):
+  data/bundles/segments/<version>/  faiss.index, vectors.npy, docs.jsonl + docs.store/,
+                                    meta.json, proj.npz (--dim), bundle.json
+  data/bundles/segments/CURRENT     swapped atomically; 12.py hot-reloads it
 """
 
-import os, json, sys
+import os, json, sys, argparse, time, shutil
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
 import numpy as np
 import faiss
-from utils.embedding import get_embeddings_batch
+from utils.embedding import throughput_report, model_fingerprint, bulk_chunk_size
+from utils.vector_manifest import VectorManifest, Checkpoint, manifest_paths
+from utils.translation_cache import get_cached, put_cached
+from utils.segment_store import SegmentStore, write_docs, write_store  # JSONL + mmapped segment columns
+from utils.projection import Projection, DIM as REDUCED_DIM, METHOD as REDUCE_METHOD
+from utils.bundle import SEGMENTS, BundleBuilder, bundle_root, load_bundle, bundle_file, write_vectors
 
 def _path(*parts):
     p1 = os.path.join("data", *parts)
@@ -30,60 +77,626 @@ def _path(*parts):
     return p1 if os.path.exists(p1) or not os.path.exists(p2) else p2
 
 INPUT_JSON   = _path("docs_japan.json")
-OUTPUT_INDEX = _path("faiss2.index")
-OUTPUT_DOCS  = _path("docs2.jsonl")
-
-if not os.path.exists(INPUT_JSON):
-    sys.exit(f"❌ Missing input: {INPUT_JSON}")
-
-# -------- Load & normalize to a list of {keyword, answer} --------
-with open(INPUT_JSON, "r", encoding="utf-8") as f:
-    raw = json.load(f)
-
-docs = []
-if isinstance(raw, dict):
-    # mapping: keyword -> answer
-    for k, a in raw.items():
-        k_norm = (k or "").strip()
-        a_norm = (a or "").strip()
-        if not k_norm or not a_norm:
+# Outputs live next to the input (avoids writing to a missing "data/" dir)
+DATA_DIR     = os.path.dirname(INPUT_JSON)
+BUNDLE_ROOT  = bundle_root(DATA_DIR, SEGMENTS)  # 12.py serves this root (api/index.py has its own)
+# Build state (manifest, vectors, checkpoint) is keyed by this path; served files live in bundles
+OUTPUT_INDEX = os.path.join(DATA_DIR, "faiss2.index")
+OUTPUT_DOCS  = os.path.join(DATA_DIR, "docs2.jsonl")  # pre-bundle builds; also names the temp docs file
+
+GEN_MODEL = os.getenv("OPENAI_GEN_MODEL", "gpt-5.2")
+SNIPPET_CHARS = 420  # must match 12.py's generation prompt snippet
+LOCALIZED_FIELDS = ("text_ja", "snippet_ja")
+
+# Same prompt + cache direction as 12.py's translate_english_to_japanese,
+# so runtime fallbacks and this stage share cache entries.
+EN2JA_SYS_MSG = (
+    "Translate the following text to Japanese. "
+    "Keep meaning accurate, preserve marketing/business terminology, and keep it concise. "
+    "Return ONLY the Japanese translation."
+)
+
+# -------- Stream & normalize {keyword, answer} pairs --------
+def iter_json_members(path: str, chunk_chars: int = 1 << 20) -> Iterator[Tuple[Optional[str], Any]]:
+    """
+    Incrementally parse a top-level JSON object or array: yields (key, value)
+    for an object member or (None, item) for an array item, holding only one
+    member plus one read buffer in memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf, pos, eof = "", 0, False
+
+        def fill() -> None:
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_chars)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+
+        def peek() -> str:
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return buf[pos:pos + 1]
+                fill()
+
+        def decode() -> Any:
+            nonlocal pos
+            peek()  # raw_decode does not skip leading whitespace
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    if end < len(buf) or eof:  # a number may continue past the buffer
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        def expect(ch: str) -> None:
+            nonlocal pos
+            if peek() != ch:
+                raise json.JSONDecodeError(f"Expecting {ch!r}", buf, pos)
+            pos += 1
+
+        opening = peek()
+        if opening not in ("{", "["):
+            sys.exit("❌ Unsupported JSON structure. Use a dict mapping or a list of objects.")
+        closing = "}" if opening == "{" else "]"
+        pos += 1
+        if peek() == closing:
+            return
+        while True:
+            key = None
+            if opening == "{":
+                key = decode()
+                expect(":")
+            yield key, decode()
+            if peek() == closing:
+                return
+            expect(",")
+
+def iter_source(path: str) -> Iterator[dict]:
+    """Cleaned {keyword, answer} docs, streamed from either supported layout."""
+    if not os.path.exists(path):
+        sys.exit(f"❌ Missing input: {path}")
+
+    for key, value in iter_json_members(path):
+        if key is not None:
+            # mapping: keyword -> answer
+            k_norm = (key or "").strip()
+            a_norm = (value or "").strip() if isinstance(value, str) else ""
+        elif isinstance(value, dict):
+            k_norm = (value.get("keyword") or "").strip()
+            a_norm = (value.get("answer")  or "").strip()
+        else:
             continue
-        docs.append({"keyword": k_norm, "answer": a_norm})
-elif isinstance(raw, list):
-    for d in raw:
-        if not isinstance(d, dict): continue
-        k = (d.get("keyword") or "").strip()
-        a = (d.get("answer")  or "").strip()
-        if not k or not a:
+        if not k_norm or not a_norm:
             continue
-        docs.append({"keyword": k, "answer": a})
-else:
-    sys.exit("❌ Unsupported JSON structure. Use a dict mapping or a list of objects.")
+        yield {"keyword": k_norm, "answer": a_norm}
+
+def _chunks(items: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    chunk: List[dict] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def read_docs(path: str) -> List[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(l) for l in f if l.strip()]
+
+# -------- FAISS index types --------
+def _auto_nlist(n: int) -> int:
+    # ~4*sqrt(n) lists, but keep >= 39 training points per centroid
+    return max(1, min(int(4 * np.sqrt(n)), n // 39))
+
+def _auto_pq_m(dim: int) -> int:
+    # Largest divisor of dim that keeps >= 16 dims per sub-quantizer
+    target = max(1, dim // 16)
+    return max(m for m in range(1, target + 1) if dim % m == 0)
+
+def _storage_code(args: argparse.Namespace, dim: int) -> Tuple[str, Dict[str, Any]]:
+    if args.storage == "float16":
+        return "SQfp16", {}
+    if args.storage == "sq8":
+        return "SQ8", {}
+    if args.storage == "pq":
+        m = args.pq_m or _auto_pq_m(dim)
+        if dim % m:
+            sys.exit(f"❌ --pq-m {m} must divide the embedding dimension {dim}.")
+        return f"PQ{m}x{args.pq_nbits}", {"pq_m": m, "pq_nbits": args.pq_nbits}
+    return "Flat", {}
+
+SCORE_TOLERANCE = 0.02  # max |score - exact cosine| for indexes that score exactly
+
+_METRICS = {faiss.METRIC_INNER_PRODUCT: "inner_product", faiss.METRIC_L2: "l2"}
+
+def _metric_name(index: faiss.Index) -> str:
+    return _METRICS.get(index.metric_type, str(index.metric_type))
+
+def _check_metric(index: faiss.Index, spec: str) -> None:
+    """index_factory silently falls back to L2 for some specs (e.g. HNSW_PQ); 12.py reads scores as cosines."""
+    parts = [index, _base_index(index)]
+    if isinstance(index, faiss.IndexRefine):
+        parts.append(faiss.downcast_index(index.refine_index))
+    wrong = list(dict.fromkeys(type(p).__name__ for p in parts if p.metric_type != faiss.METRIC_INNER_PRODUCT))
+    if wrong:
+        sys.exit(f"❌ FAISS built '{spec}' with a non inner-product metric ({', '.join(wrong)}); "
+                 f"scores would not be cosines. Pick another --index-type/--storage combination.")
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+    """The searching index underneath an optional refine (rescoring) wrapper."""
+    if isinstance(index, faiss.IndexRefine):
+        return faiss.downcast_index(index.base_index)
+    return index
+
+def _train_sample(emb: np.ndarray, limit: int) -> np.ndarray:
+    """All vectors when they fit the limit, else `limit` rows spread evenly over the file."""
+    if len(emb) <= limit:
+        return np.ascontiguousarray(emb, dtype="float32")
+    rows = np.linspace(0, len(emb) - 1, limit).astype("int64")
+    return np.ascontiguousarray(emb[rows], dtype="float32")
+
+def make_index(emb: np.ndarray, args: argparse.Namespace) -> Tuple[faiss.Index, Dict[str, Any]]:
+    """
+    Build + fill the requested index type/storage from normalized (memory-mapped)
+    vectors, adding them one chunk at a time. Returns (index, params for the meta file).
+    """
+    n, dim = emb.shape
+    code, params = _storage_code(args, dim)
+    if args.index_type == "hnsw":
+        spec = f"HNSW{args.hnsw_m}" + ("" if code == "Flat" else f"_{code}")
+        params.update({"m": args.hnsw_m, "ef_construction": args.hnsw_ef_construction,
+                       "ef_search": args.hnsw_ef_search})
+    elif args.index_type == "ivf":
+        nlist = args.ivf_nlist or _auto_nlist(n)
+        spec = f"IVF{nlist},{code}"
+        params.update({"nlist": nlist, "nprobe": min(args.ivf_nprobe, nlist)})
+    else:
+        spec = code
+    if args.rescore == "fp16":
+        spec += ",Refine(SQfp16)"
+    elif args.rescore == "flat":
+        spec += ",RFlat"
+
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    _check_metric(index, spec)
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efConstruction = args.hnsw_ef_construction
+    if not index.is_trained:
+        index.train(_train_sample(emb, args.train_size))
+    for start in range(0, n, args.chunk_size):
+        index.add(np.ascontiguousarray(emb[start:start + args.chunk_size], dtype="float32"))
+
+    # Defaults stored in the index; 12.py can override per query
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = args.hnsw_ef_search
+    if isinstance(base, faiss.IndexIVF):
+        base.nprobe = params["nprobe"]
+    if isinstance(index, faiss.IndexRefine):
+        index.k_factor = float(args.rescore_k_factor)
+        params.update({"rescore": args.rescore, "k_factor": args.rescore_k_factor})
+    params["factory"] = spec
+    return index, params
+
+def index_memory(index_path: str, n: int, dim: int) -> Dict[str, Any]:
+    index_bytes = os.path.getsize(index_path)
+    float32_bytes = n * dim * 4
+    return {
+        "index_bytes": index_bytes,
+        "float32_bytes": float32_bytes,
+        "bytes_per_vector": round(index_bytes / max(1, n), 1),
+        "ratio_vs_float32": round(index_bytes / max(1, float32_bytes), 4),
+    }
+
+def _bench_queries(emb: np.ndarray, count: int, seed: int = 0) -> np.ndarray:
+    """Synthetic queries: normalized midpoints of two random docs (like a blended brief)."""
+    rng = np.random.default_rng(seed)
+    a = emb[rng.integers(0, len(emb), count)]
+    b = emb[rng.integers(0, len(emb), count)]
+    q = (a + b).astype("float32")
+    return q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-12)
+
+def _search_params_grid(index: faiss.Index, params: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        grid = [(f"efSearch={ef}", faiss.SearchParametersHNSW(efSearch=ef)) for ef in (16, 32, 64, 128, 256)]
+    elif isinstance(base, faiss.IndexIVF):
+        nprobes = sorted({p for p in (1, 2, 4, 8, 16, 32, 64) if p <= params["nlist"]} | {params["nprobe"]})
+        grid = [(f"nprobe={p}", faiss.SearchParametersIVF(nprobe=p)) for p in nprobes]
+    else:
+        grid = [("default", None)]
+    if isinstance(index, faiss.IndexRefine):
+        k_factor = params["k_factor"]
+        grid = [(f"{label} rescore x{k_factor:g}",
+                 faiss.IndexRefineSearchParameters(k_factor=k_factor, base_index_params=p) if p is not None
+                 else faiss.IndexRefineSearchParameters(k_factor=k_factor))
+                for label, p in grid]
+    return grid
+
+def benchmark_index(index: faiss.Index, emb: np.ndarray, params: Dict[str, Any],
+                    num_queries: int = 200, k: int = 10) -> List[Dict[str, Any]]:
+    """
+    recall@k and per-query latency against an exact float32 IndexFlatIP over the same vectors.
+    Queries are issued one at a time, like the server does. Scores are checked too:
+    top1_score_err is the largest |top-1 score - exact top-1 score|, score_err the
+    largest |returned score - exact inner product of the returned doc|. The build
+    fails when scores are not descending (not an inner-product metric) or, for
+    indexes that should score exactly (float32/float16/sq8 codes or rescored),
+    when score_err exceeds SCORE_TOLERANCE.
+    """
+    k = min(k, len(emb))
+    queries = _bench_queries(emb, num_queries)
+    flat = faiss.IndexFlatIP(emb.shape[1])
+    flat.add(emb)
+    exact_scores = params.get("rescore") or params.get("pq_m") is None
+
+    def _run(idx, search_params):
+        found, scores = [], []
+        t0 = time.perf_counter()
+        for q in queries:
+            if search_params is None:
+                D, I = idx.search(q[None, :], k)
+            else:
+                D, I = idx.search(q[None, :], k, params=search_params)
+            found.append(I[0])
+            scores.append(D[0])
+        return np.array(found), np.array(scores), (time.perf_counter() - t0) * 1000.0 / len(queries)
+
+    truth, truth_scores, flat_ms = _run(flat, None)
+    report = [{"setting": "flat (baseline)", "recall_at_k": 1.0, "latency_ms": round(flat_ms, 4),
+               "top1_score_err": 0.0, "score_err": 0.0}]
+    problems = []
+    for label, search_params in _search_params_grid(index, params):
+        found, scores, ms = _run(index, search_params)
+        recall = np.mean([len(np.intersect1d(f, t)) / k for f, t in zip(found, truth)])
+        valid = found >= 0
+        exact = np.einsum("qd,qkd->qk", queries, np.asarray(emb[np.where(valid, found, 0)], dtype="float32"))
+        top1_err = float(np.max(np.abs(scores[:, 0] - truth_scores[:, 0])))
+        score_err = float(np.max(np.abs(scores - exact)[valid])) if valid.any() else 0.0
+        report.append({"setting": label, "recall_at_k": round(float(recall), 4), "latency_ms": round(ms, 4),
+                       "top1_score_err": round(top1_err, 4), "score_err": round(score_err, 4)})
+        if np.any(np.diff(np.where(valid, scores, -np.inf), axis=1) > 1e-5):
+            problems.append(f"{label}: scores are not descending (metric is not inner product)")
+        elif exact_scores and score_err > SCORE_TOLERANCE:
+            problems.append(f"{label}: scores off the exact cosine by up to {score_err:.4f}")
+
+    print(f"📊 recall@{k} vs latency ({len(queries)} queries, {index.ntotal} vectors):")
+    for r in report:
+        print(f"   {r['setting']:<18} recall={r['recall_at_k']:.4f}  {r['latency_ms']:.3f} ms/query  "
+              f"top-1 score err={r['top1_score_err']:.4f}  score err={r['score_err']:.4f}")
+    if problems:
+        sys.exit("❌ Index scores do not match exact inner-product search:\n   " + "\n   ".join(problems))
+    return report
+
+def benchmark_dims(emb: np.ndarray, dims: List[int], method: str, num_queries: int = 200,
+                   k: int = 10, sample: int = 100_000, block: int = 65536) -> List[Dict[str, Any]]:
+    """
+    recall@k of exact search at each reduced dimension vs. exact full-width search,
+    plus the per-query scan cost (numpy, one query at a time like the API). The scan
+    is timed on the first `block` vectors only and scaled linearly to all docs, so
+    scan_ms is an estimate (scan_rows_timed says how many rows were timed).
+    """
+    k = min(k, len(emb))
+    queries = _bench_queries(emb, num_queries)
+
+    def _topk(proj: Optional[Projection]) -> Tuple[np.ndarray, float]:
+        q = proj.apply(queries) if proj is not None else queries
+        # running top-k over blocks, so memory stays queries x (k + block)
+        best_ids = np.zeros((len(q), 0), dtype="int64")
+        best = np.zeros((len(q), 0), dtype="float32")
+        for start in range(0, len(emb), block):
+            docs = np.asarray(emb[start:start + block], dtype="float32")
+            ids = np.concatenate([best_ids, np.broadcast_to(np.arange(start, start + len(docs)), (len(q), len(docs)))], axis=1)
+            scores = np.concatenate([best, q @ (proj.apply(docs) if proj is not None else docs).T], axis=1)
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_ids, best = np.take_along_axis(ids, keep, 1), np.take_along_axis(scores, keep, 1)
+        top = best_ids
+        # latency: one query against the (already projected) matrix, like serving
+        matrix = np.asarray(emb[:block], dtype="float32")
+        matrix = proj.apply(matrix) if proj is not None else matrix
+        t0 = time.perf_counter()
+        for row in q:
+            np.argpartition(-(matrix @ row), k - 1)[:k]
+        ms = (time.perf_counter() - t0) * 1000.0 / len(q) * (len(emb) / len(matrix))
+        return top, ms
+
+    full_dim = int(emb.shape[1])
+    timed = min(block, len(emb))
+    truth, full_ms = _topk(None)
+    report = [{"dim": full_dim, "method": "full", "recall_at_k": 1.0,
+               "bytes_per_vector": full_dim * 4, "scan_ms": round(full_ms, 4), "scan_rows_timed": timed}]
+    for dim in sorted(d for d in dims if 0 < d < full_dim):
+        proj = Projection.fit(emb, dim, method, sample=sample)
+        found, ms = _topk(proj)
+        recall = np.mean([len(np.intersect1d(f, t)) / k for f, t in zip(found, truth)])
+        report.append({"dim": dim, "method": method, "recall_at_k": round(float(recall), 4),
+                       "bytes_per_vector": dim * 4, "scan_ms": round(ms, 4), "scan_rows_timed": timed})
+
+    print(f"📐 recall@{k} vs dimension ({len(queries)} queries, {len(emb)} vectors):")
+    if timed < len(emb):
+        print(f"   (ms/query timed on the first {timed} vectors, extrapolated linearly to {len(emb)})")
+    for r in report:
+        print(f"   {r['dim']:>5}d {r['method']:<8} recall={r['recall_at_k']:.4f}  "
+              f"{r['bytes_per_vector']} B/vector  {r['scan_ms']:.3f} ms/query")
+    return report
+
+def write_meta(path: str, meta: Dict[str, Any]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+# -------- Build embeddings + FAISS (IP) index --------
+def current_docs_path() -> Optional[str]:
+    """Docs of the live bundle (or of a pre-bundle build), None before the first build."""
+    bundle = load_bundle(BUNDLE_ROOT)
+    if bundle is not None:
+        return bundle_file(bundle, "docs")
+    return OUTPUT_DOCS if os.path.exists(OUTPUT_DOCS) else None
+
+def _previous_docs() -> Tuple[Optional[SegmentStore], Dict[str, int]]:
+    """Last build's docs (mmapped) + keyword -> row, to carry localization over."""
+    path = current_docs_path()
+    if path is None:
+        return None, {}
+    store = SegmentStore.open(path)
+    return store, {store.keyword(i): i for i in range(len(store))}
+
+def embed_docs(args: argparse.Namespace) -> Tuple[np.ndarray, str, Dict[str, Any]]:
+    """
+    Stream the source in chunks: embed (reusing unchanged vectors), append the
+    vectors to the manifest's file and the docs to a temp JSONL, checkpointing
+    after every chunk. Returns (memory-mapped normalized vectors, temp docs path,
+    embedding stats for the bundle).
+    """
+    manifest = VectorManifest(OUTPUT_INDEX, full=args.full)
+    checkpoint = Checkpoint(OUTPUT_INDEX, INPUT_JSON)
+    docs_tmp = OUTPUT_DOCS + ".building"
+    state = checkpoint.load()
+    if state and (state.get("full") != args.full or not os.path.exists(docs_tmp)):
+        state = None
+    resumed = manifest.open(state["manifest"] if state else None)
+    docs_f = open(docs_tmp, "r+b" if resumed else "wb")
+    done = 0
+    if resumed:
+        done = state["items"]
+        docs_f.truncate(state["docs_bytes"])
+        docs_f.seek(state["docs_bytes"])
+        print(f"↩️ Resuming after {done} docs ({checkpoint.path})")
+
+    previous, previous_rows = _previous_docs()
+    chunk_size = bulk_chunk_size(args.chunk_size, workers=args.workers)  # keep every worker busy
+    print(f"Streaming {INPUT_JSON} in chunks of {chunk_size}. Embedding...")
+    for chunk in _chunks(islice(iter_source(INPUT_JSON), done, None), chunk_size):
+        texts = [f"Keyword: {d['keyword']}\nText: {d['answer']}" for d in chunk]
+        manifest.add([d["keyword"] for d in chunk], texts, workers=args.workers)
+
+        # Paired metadata (keep localization for unchanged texts)
+        for d in chunk:
+            rec = {"keyword": d["keyword"], "text": d["answer"]}
+            row = previous_rows.get(d["keyword"])
+            if row is not None and previous.text(row) == rec["text"] and previous.snippet_ja(row):
+                prev = previous.record(row)
+                rec.update({f: prev[f] for f in LOCALIZED_FIELDS if f in prev})
+            docs_f.write((json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8"))
+        docs_f.flush()
+
+        done += len(chunk)
+        checkpoint.save({"items": done, "full": args.full, "manifest": manifest.position(),
+                         "docs_bytes": docs_f.tell()})
+        print(f"  … {done} docs ({manifest.embedded} embedded, {manifest.reused} reused)")
+    docs_f.close()
+
+    if not manifest.rows:
+        sys.exit("❌ No valid (keyword, answer) pairs found after cleaning.")
+    emb = manifest.commit()
+    print(f"♻️ Reused {manifest.reused} vectors, embedded {manifest.embedded} new/changed, "
+          f"dropped {manifest.removed} removed → {manifest_paths(OUTPUT_INDEX)[1]}")
+    print(f"⚡ {throughput_report()}")
+    stats = {"docs": int(manifest.rows), "embedded": int(manifest.embedded), "reused": int(manifest.reused),
+             "removed": int(manifest.removed), "throughput": throughput_report()}
+    return emb, docs_tmp, stats
+
+def build_index(args: argparse.Namespace) -> None:
+    t0 = time.perf_counter()
+    full, docs_tmp, stats = embed_docs(args)
+    builder = BundleBuilder(BUNDLE_ROOT)
+    try:
+        projection = None
+        if args.dim and args.dim < full.shape[1]:
+            projection = Projection.fit(full, args.dim, args.reduce, sample=args.train_size)
+            print(f"📐 Reduced {full.shape[1]} → {args.dim} dims ({args.reduce}) for the index")
+            projection.save(builder.path("projection", "proj.npz"))
+        # Served vectors (api/index.py) and the index input: normalized, reduced if requested
+        emb = write_vectors(builder.path("vectors", "vectors.npy"), full, projection=projection)
+
+        index, params = make_index(emb, args)
+        index_path = builder.path("index", "faiss.index")
+        faiss.write_index(index, index_path)
+
+        memory = index_memory(index_path, len(emb), emb.shape[1])
+        print(f"💾 Index memory: {memory['index_bytes'] / 1e6:.2f} MB "
+              f"({memory['bytes_per_vector']} B/vector, {memory['ratio_vs_float32']:.1%} of float32)")
+
+        meta = {
+            "index_type": args.index_type,
+            "storage": args.storage,
+            "faiss_class": type(index).__name__,
+            "metric": _metric_name(index),
+            "dim": int(emb.shape[1]),
+            "embedding_dim": int(full.shape[1]),
+            "projection": projection.describe() if projection is not None else None,
+            "ntotal": int(index.ntotal),
+            "params": params,
+            "memory": memory,
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        if args.index_type != "flat" or args.storage != "float32" or args.benchmark:
+            meta["benchmark"] = benchmark_index(index, emb, params, num_queries=args.bench_queries, k=args.bench_k)
+        if args.bench_dims:
+            dims = [int(d) for d in args.bench_dims.split(",") if d.strip()]
+            meta["dim_benchmark"] = benchmark_dims(full, dims, args.reduce, num_queries=args.bench_queries,
+                                                   k=args.bench_k, sample=args.train_size)
+        write_meta(builder.path("meta", "meta.json"), meta)
+
+        docs_path = builder.path("docs", "docs.jsonl")
+        write_store(docs_path, source=docs_tmp)
+        os.replace(docs_tmp, docs_path)
+        builder.files["docs_store"] = "docs.store"  # written by write_store next to docs.jsonl
+
+        stats.update({"index_type": args.index_type, "storage": args.storage, "index_bytes": memory["index_bytes"],
+                      "build_seconds": round(time.perf_counter() - t0, 1)})
+        bundle_dir = builder.publish(_fingerprint(int(full.shape[1]), int(emb.shape[1]), projection), stats)
+    except BaseException:
+        builder.discard()
+        raise
+    Checkpoint(OUTPUT_INDEX, INPUT_JSON).clear()
+
+    print(f"✅ Indexed {len(full)} docs ({args.index_type}, {args.storage}) → {bundle_dir}")
+    print(f"🚀 Published bundle {builder.version} (servers pick it up without a restart)")
+
+def _fingerprint(embedding_dim: int, dim: int, projection: Optional[Projection]) -> Dict[str, Any]:
+    return {"kind": SEGMENTS, "model": model_fingerprint(), "embedding_dim": embedding_dim, "dim": dim,
+            "projection": projection.describe() if projection is not None else None}
+
+# -------- Localization (EN -> JA, precomputed) --------
+def translate_en_to_ja(text: str, max_completion_tokens: int = 500) -> str:
+    # openai only loads for --localize; same proxy-aware client as 12.py
+    from utils.openai_client import openai_client, has_japanese
+    # Same skips as 12.py: already Japanese, or too short to be worth a call
+    if not text or has_japanese(text) or len(text.strip()) < 15:
+        return text
+    cached = get_cached("en2ja", GEN_MODEL, text)
+    if cached is not None:
+        return cached
+    resp = openai_client().chat.completions.create(
+        model=GEN_MODEL,
+        messages=[{"role": "system", "content": EN2JA_SYS_MSG},
+                  {"role": "user", "content": text}],
+        temperature=0.0,
+        max_completion_tokens=max_completion_tokens
+    )
+    out = resp.choices[0].message.content.strip()
+    put_cached("en2ja", GEN_MODEL, text, out)
+    return out
+
+def localize_doc(doc: dict) -> Dict[str, str]:
+    text = doc.get("text") or ""
+    snippet = text[:SNIPPET_CHARS]
+    snippet_ja = translate_en_to_ja(snippet)
+    text_ja = snippet_ja if len(text) <= SNIPPET_CHARS else translate_en_to_ja(text, max_completion_tokens=2000)
+    return {"text_ja": text_ja, "snippet_ja": snippet_ja}
+
+def localize_docs(path: str, chunk_size: int = 50, workers: int = 8) -> int:
+    docs = read_docs(path)
+    if not docs:
+        sys.exit(f"❌ Missing or empty docs: {path} (build the index first)")
 
-if not docs:
-    sys.exit("❌ No valid (keyword, answer) pairs found after cleaning.")
+    todo = [i for i, d in enumerate(docs) if not all(f in d for f in LOCALIZED_FIELDS)]
+    print(f"🌐 Localizing {len(todo)}/{len(docs)} docs (chunk={chunk_size}, workers={workers})...")
+    if not todo:
+        return 0
 
-# -------- Build embedding corpus --------
-texts = [f"Keyword: {d['keyword']}\nText: {d['answer']}" for d in docs]
-print(f"Loaded {len(texts)} docs. Embedding...")
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for start in range(0, len(todo), chunk_size):
+            chunk = todo[start:start + chunk_size]
+            futures = {i: pool.submit(localize_doc, docs[i]) for i in chunk}
+            for i, fut in futures.items():
+                try:
+                    docs[i].update(fut.result())
+                except Exception as e:
+                    failed += 1
+                    print(f"⚠️ Localization failed for {docs[i].get('keyword')!r}: {e}")
+            # Checkpoint: a re-run resumes from the first doc without text_ja
+            # (for bundles the translations are cached, so a re-run replays them from the cache)
+            write_docs(path, docs)
+            print(f"  … {min(start + chunk_size, len(todo))}/{len(todo)}")
 
-emb = get_embeddings_batch(texts).astype("float32")
+    if failed:
+        print(f"⚠️ {failed} docs failed; re-run with --localize-only to retry them.")
+    print(f"✅ Localized docs saved → {path}")
+    return len(todo) - failed
 
-# L2-normalize => cosine via inner product
-norms = np.linalg.norm(emb, axis=1, keepdims=True) + 1e-12
-emb = emb / norms
+def localize_bundle(chunk_size: int = 50, workers: int = 8) -> None:
+    """
+    Localize the live bundle's docs into a new bundle version (vectors, index and
+    projection are hard-linked, not copied), so servers swap to it like to a rebuild.
+    Builds from before bundles are localized in place.
+    """
+    bundle = load_bundle(BUNDLE_ROOT)
+    if bundle is None:
+        localize_docs(OUTPUT_DOCS, chunk_size=chunk_size, workers=workers)
+        return
+    builder = BundleBuilder(BUNDLE_ROOT)
+    try:
+        builder.link_from(bundle, [k for k in bundle["files"] if k not in ("docs", "docs_store")])
+        docs_path = builder.path("docs", bundle["files"]["docs"])
+        shutil.copyfile(bundle_file(bundle, "docs"), docs_path)
+        builder.files["docs_store"] = bundle["files"].get("docs_store", "docs.store")
+        if not localize_docs(docs_path, chunk_size=chunk_size, workers=workers):
+            builder.discard()
+            return
+        builder.publish(bundle["fingerprint"], {**bundle.get("stats", {}), "localized_from": bundle["version"]})
+    except BaseException:
+        builder.discard()
+        raise
+    print(f"🚀 Published bundle {builder.version} with localized docs")
 
-# -------- Build FAISS (IP) index --------
-dim = emb.shape[1]
-index = faiss.IndexFlatIP(dim)
-index.add(emb)
-faiss.write_index(index, OUTPUT_INDEX)
+def main():
+    ap = argparse.ArgumentParser(description="Build the FAISS index + docs from docs_japan.json")
+    ap.add_argument("--full", action="store_true", help="Re-embed every doc instead of reusing unchanged vectors.")
+    ap.add_argument("--chunk-size", type=int, default=512, help="Docs per embedded/checkpointed chunk (and per index add; embedding raises it to workers x batch).")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="Local embedding processes (EMBEDDING_BACKEND=local; default EMBEDDING_WORKERS or 1).")
+    ap.add_argument("--train-size", type=int, default=100_000, help="Max vectors sampled to train IVF/SQ/PQ codes.")
+    ap.add_argument("--localize", action="store_true", help="After building, precompute text_ja/snippet_ja for every doc.")
+    ap.add_argument("--localize-only", action="store_true", help="Only run (or resume) localization on the existing docs file.")
+    ap.add_argument("--localize-chunk", type=int, default=50, help="Docs per checkpointed chunk.")
+    ap.add_argument("--localize-workers", type=int, default=8, help="Concurrent translation requests.")
+    ap.add_argument("--index-type", choices=["flat", "hnsw", "ivf"], default="flat", help="FAISS index type.")
+    ap.add_argument("--hnsw-m", type=int, default=32, help="HNSW graph degree (M).")
+    ap.add_argument("--hnsw-ef-construction", type=int, default=200, help="HNSW efConstruction.")
+    ap.add_argument("--hnsw-ef-search", type=int, default=64, help="Default HNSW efSearch stored in the index.")
+    ap.add_argument("--ivf-nlist", type=int, default=0, help="IVF lists (0 = auto, ~4*sqrt(n)).")
+    ap.add_argument("--ivf-nprobe", type=int, default=8, help="Default IVF nprobe stored in the index.")
+    ap.add_argument("--storage", choices=["float32", "float16", "sq8", "pq"], default="float32",
+                    help="Vector storage inside the index.")
+    ap.add_argument("--pq-m", type=int, default=0, help="PQ sub-quantizers (0 = auto, dim/16; must divide dim).")
+    ap.add_argument("--pq-nbits", type=int, default=8, help="Bits per PQ sub-quantizer code.")
+    ap.add_argument("--rescore", choices=["none", "fp16", "flat"], default="none",
+                    help="Rescore compressed candidates with fp16 or exact float32 vectors.")
+    ap.add_argument("--rescore-k-factor", type=float, default=4.0, help="Candidates fetched per result before rescoring.")
+    ap.add_argument("--benchmark", action="store_true", help="Also run the recall/latency report for exact float32 flat indexes.")
+    ap.add_argument("--bench-queries", type=int, default=200, help="Queries for the recall/latency report.")
+    ap.add_argument("--bench-k", type=int, default=10, help="k for recall@k.")
+    ap.add_argument("--dim", type=int, default=REDUCED_DIM,
+                    help="Index dimension (0 = full embedding width; default EMBEDDING_DIM).")
+    ap.add_argument("--reduce", choices=["pca", "truncate"], default=REDUCE_METHOD,
+                    help="How to reduce to --dim: PCA learned at build, or Matryoshka truncation.")
+    ap.add_argument("--bench-dims", default="",
+                    help="Comma-separated dims for a recall@k vs. dimension report (e.g. 64,128,256).")
+    args = ap.parse_args()
+    if args.index_type == "hnsw" and args.storage == "pq" and not args.localize_only:
+        # FAISS builds HNSW_PQ with the L2 metric whatever metric is requested
+        ap.error("--index-type hnsw --storage pq is not supported (FAISS ignores the inner-product metric "
+                 "for HNSW_PQ); use --index-type ivf --storage pq, or hnsw with --storage sq8/float16.")
 
-# -------- Save paired metadata --------
-os.makedirs(os.path.dirname(OUTPUT_DOCS), exist_ok=True)
-with open(OUTPUT_DOCS, "w", encoding="utf-8") as f:
-    for d in docs:
-        f.write(json.dumps({"keyword": d["keyword"], "text": d["answer"]}, ensure_ascii=False) + "\n")
+    if not args.localize_only:
+        build_index(args)
+    if args.localize or args.localize_only:
+        localize_bundle(chunk_size=args.localize_chunk, workers=args.localize_workers)
 
-print(f"✅ Indexed {len(docs)} docs → {OUTPUT_INDEX}")
-print(f"🧾 Metadata saved → {OUTPUT_DOCS}")
+if __name__ == "__main__":
+    main()
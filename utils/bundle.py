@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+utils/bundle.py
+Versioned index bundles: every build writes one self-describing directory and
+publishes it atomically. 12.py (FAISS) and api/index.py (numpy) both serve from it.
+
+  Data/bundles/segments/       ingest_index_json.py (docs_japan.json) -> 12.py / app.py
+  Data/bundles/serverless/     create_embeddings.py (docs.jsonl)      -> api/index.py
+    CURRENT                    name of the live version (a few bytes, replaced atomically)
+    20261018T031500123456-3f9a2c/
+      bundle.json              version, fingerprint, file names, build stats
+      vectors.npy              L2-normalized rows (reduced when built with --dim), mmap-able
+      docs.jsonl + docs.store/ segment docs + columns (utils/segment_store.py)
+      faiss.index              ingest_index_json.py builds (12.py builds a flat one otherwise)
+      proj.npz                 query projection, only for reduced-dim builds
+      meta.json                index type/params/benchmarks (ingest_index_json.py)
+
+The two pipelines index different corpora, so each publishes under its own
+root and neither can replace the other's CURRENT.
+
+fingerprint = {"kind": "segments", "model": "local:BAAI/bge-small-en-v1.5",
+               "embedding_dim": 384, "dim": 384, "projection": null}
+A server whose query model differs from fingerprint["model"], or that serves the
+other pipeline's kind, refuses the bundle (BundleMismatch) instead of returning
+meaningless results.
+
+Builders stage into .staging-<version>/ and publish() renames it into place, then
+swaps CURRENT. Servers poll CURRENT every BUNDLE_CHECK_SECS and open the new
+version next to the old one, so requests already running finish on the bundle
+they started with. Only the newest BUNDLE_KEEP versions are kept (files a
+running process still maps stay readable until it lets go of them).
+"""
+
+from __future__ import annotations
+import os, json, time, shutil
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+FORMAT = 1
+KEEP = int(os.getenv("BUNDLE_KEEP", "3"))
+CHECK_SECS = float(os.getenv("BUNDLE_CHECK_SECS", "5"))  # 0 = never look for a new bundle
+CURRENT = "CURRENT"
+MANIFEST = "bundle.json"
+# Bundle kinds, one root each (bundle_root): FAISS segments vs. the serverless corpus
+SEGMENTS = "segments"
+SERVERLESS = "serverless"
+
+class BundleMismatch(RuntimeError):
+    """The bundle's vectors come from a different embedding model than the queries."""
+
+def _write_atomic(path: str, text: str) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def new_version() -> str:
+    # names sort by build time (prune relies on it); the suffix keeps concurrent builders apart
+    now = time.time()
+    return time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)) + f"{int(now % 1 * 1e6):06d}-" + os.urandom(3).hex()
+
+def bundle_root(data_dir: str, kind: str) -> str:
+    return os.path.join(data_dir, "bundles", kind)
+
+# -------------------------------
+# Reading
+# -------------------------------
+def current_version(root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(root, CURRENT), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def load_bundle(root: str, version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """bundle.json of `version` (default: CURRENT) plus its directory, or None if there is none."""
+    version = version or current_version(root)
+    if not version:
+        return None
+    bundle_dir = os.path.join(root, version)
+    with open(os.path.join(bundle_dir, MANIFEST), "r", encoding="utf-8") as f:
+        bundle = json.load(f)
+    bundle["dir"] = bundle_dir
+    return bundle
+
+def bundle_file(bundle: Dict[str, Any], key: str) -> Optional[str]:
+    name = bundle.get("files", {}).get(key)
+    return os.path.join(bundle["dir"], name) if name else None
+
+def check_model(fingerprint: Optional[Dict[str, Any]], query_model: str, kind: Optional[str] = None) -> None:
+    built_kind = (fingerprint or {}).get("kind")
+    if kind and built_kind and built_kind != kind:
+        raise BundleMismatch(
+            f"Index bundle is a {built_kind} build but this server serves {kind} bundles. "
+            f"Publish it with the matching pipeline."
+        )
+    built = (fingerprint or {}).get("model")
+    if built and built != query_model:
+        raise BundleMismatch(
+            f"Index bundle was built with {built} but queries are embedded with {query_model}. "
+            f"Set EMBEDDING_BACKEND/EMBEDDING_MODEL to match, or rebuild the bundle."
+        )
+
+# -------------------------------
+# Writing
+# -------------------------------
+def write_vectors(path: str, vectors: np.ndarray, dtype: str = "float32", projection=None,
+                  block: int = 65536) -> np.ndarray:
+    """Copy (or project) memory-mapped vectors into a .npy block by block; returns it mapped."""
+    if projection is not None:
+        return projection.apply_to_npy(vectors, path, dtype=dtype, block=block)
+    tmp = path + ".tmp"
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=vectors.shape)
+    for start in range(0, len(vectors), block):
+        out[start:start + block] = vectors[start:start + block]
+    out.flush()
+    del out
+    os.replace(tmp, path)
+    return np.load(path, mmap_mode="r")
+
+class BundleBuilder:
+    """Stage one bundle's files under `root`, then publish() them as the new CURRENT."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.version = new_version()
+        self.dir = os.path.join(root, ".staging-" + self.version)
+        os.makedirs(self.dir)
+        self.files: Dict[str, str] = {}
+
+    def path(self, key: str, name: str) -> str:
+        """Where to write file `key` (vectors, docs, index, projection, meta, ...)."""
+        self.files[key] = name
+        return os.path.join(self.dir, name)
+
+    def link_from(self, bundle: Dict[str, Any], keys: List[str]) -> None:
+        """Reuse unchanged files of another bundle (hard links, copies across filesystems)."""
+        for key in keys:
+            src = bundle_file(bundle, key)
+            if not src or not os.path.exists(src):
+                continue
+            dst = self.path(key, bundle["files"][key])
+            if os.path.isdir(src):
+                shutil.copytree(src, dst, copy_function=_link_or_copy)
+            else:
+                _link_or_copy(src, dst)
+
+    def publish(self, fingerprint: Dict[str, Any], stats: Dict[str, Any]) -> str:
+        manifest = {
+            "format": FORMAT,
+            "version": self.version,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "fingerprint": fingerprint,
+            "files": self.files,
+            "stats": stats,
+        }
+        _write_atomic(os.path.join(self.dir, MANIFEST), json.dumps(manifest, ensure_ascii=False, indent=2))
+        final = os.path.join(self.root, self.version)
+        os.rename(self.dir, final)
+        _write_atomic(os.path.join(self.root, CURRENT), self.version)
+        prune(self.root)
+        return final
+
+    def discard(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def prune(root: str, keep: int = KEEP) -> List[str]:
+    """Delete all but the newest `keep` published versions (never CURRENT)."""
+    live = current_version(root)
+    versions = sorted(v for v in os.listdir(root)
+                      if not v.startswith(".") and os.path.isfile(os.path.join(root, v, MANIFEST)))
+    removed = [v for v in versions[:-max(1, keep)] if v != live]
+    for v in removed:
+        shutil.rmtree(os.path.join(root, v), ignore_errors=True)
+    return removed
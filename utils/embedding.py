@@ -7,11 +7,24 @@ Choose backend with EMBEDDING_BACKEND=local|openai (default: local).
 
 Recommended English model (fast & accurate):
   EMBEDDING_MODEL="BAAI/bge-small-en-v1.5"
+
+Caching (keyed by backend + model + sha256(text)):
+  EMBEDDING_CACHE_SIZE=4096          in-memory LRU entries (0 disables)
+  EMBEDDING_CACHE_PATH=...sqlite3    optional persistent tier (unset = off)
+  EMBEDDING_CACHE_MAX_ENTRIES=200000 size bound for the persistent tier (least recently
+                                     used rows go first; checked every few writes)
+
+Bulk jobs (local backend):
+  EMBEDDING_WORKERS=1                processes, each with its own ONNX session
+                                     and cpu_count // workers threads
+OpenAI backend: concurrency and RPM/TPM limits, see utils/openai_embedding.py.
 """
 
 from __future__ import annotations
-import os, time
-from typing import Iterable, List
+import os, time, sqlite3, hashlib, threading, multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import numpy as np
 
 # -------------------------------
@@ -21,16 +34,23 @@ BACKEND = os.getenv("EMBEDDING_BACKEND", "local").lower()  # local | openai
 LOCAL_MODEL = os.getenv("EMBEDDING_MODEL") or "BAAI/bge-small-en-v1.5"
 OPENAI_MODEL = os.getenv("EMBEDDING_MODEL") or "text-embedding-3-small"
 
+CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH") or None
+CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+
 # -------------------------------
 # Lazy loaders
 # -------------------------------
 _fastembed_model = None
-def _load_fastembed(model_name: str = LOCAL_MODEL):
+def _load_fastembed(model_name: str = LOCAL_MODEL, threads: Optional[int] = None):
     global _fastembed_model
     if _fastembed_model is None:
         from fastembed import TextEmbedding
         try:
-            _fastembed_model = TextEmbedding(model_name=model_name)
+            kwargs = {"threads": threads} if threads else {}
+            _fastembed_model = TextEmbedding(model_name=model_name, **kwargs)
         except ValueError:
             # Show supported models for quick debug
             from fastembed import TextEmbedding as _TE
@@ -41,16 +61,209 @@ def _load_fastembed(model_name: str = LOCAL_MODEL):
             )
     return _fastembed_model
 
-_openai_client = None
-def _load_openai():
-    global _openai_client
-    if _openai_client is None:
-        from openai import OpenAI
-        key = os.getenv("OPENAI_API_KEY")
-        if not key:
-            raise RuntimeError("OPENAI_API_KEY is not set (required for EMBEDDING_BACKEND=openai).")
-        _openai_client = OpenAI(api_key=key)
-    return _openai_client
+# -------------------------------
+# Cache (memory LRU + optional SQLite tier)
+# -------------------------------
+def _model_name() -> str:
+    return OPENAI_MODEL if BACKEND == "openai" else LOCAL_MODEL
+
+def model_fingerprint() -> str:
+    """Backend + model; vectors from different fingerprints are not comparable."""
+    return f"{BACKEND}:{_model_name()}"
+
+def _cache_key(text: str) -> str:
+    h = hashlib.sha256()
+    for part in (BACKEND, _model_name(), text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+_mem_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_mem_lock = threading.Lock()
+
+def _mem_get(key: str) -> Optional[np.ndarray]:
+    with _mem_lock:
+        vec = _mem_cache.get(key)
+        if vec is not None:
+            _mem_cache.move_to_end(key)
+        return vec
+
+def _mem_put(key: str, vec: np.ndarray) -> None:
+    if CACHE_SIZE <= 0:
+        return
+    with _mem_lock:
+        _mem_cache[key] = vec
+        _mem_cache.move_to_end(key)
+        while len(_mem_cache) > CACHE_SIZE:
+            _mem_cache.popitem(last=False)
+
+_disk_conn: Optional[sqlite3.Connection] = None
+_disk_pid: Optional[int] = None
+_disk_lock = threading.Lock()
+_disk_writes = 0
+_TRIM_EVERY = 20  # check the size bound every N disk writes
+
+def _disk() -> Optional[sqlite3.Connection]:
+    global _disk_conn, _disk_pid
+    if not CACHE_PATH:
+        return None
+    if _disk_conn is not None and _disk_pid == os.getpid():
+        return _disk_conn
+    try:
+        os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=10.0, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vec BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+    except sqlite3.Error as e:
+        print(f"⚠️ Embedding cache unavailable ({CACHE_PATH}): {e}")
+        return None
+    _disk_conn, _disk_pid = conn, os.getpid()
+    return _disk_conn
+
+def _disk_get_many(keys: List[str]) -> Dict[str, np.ndarray]:
+    found: Dict[str, np.ndarray] = {}
+    with _disk_lock:
+        conn = _disk()
+        if conn is None or not keys:
+            return found
+        try:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i+500]
+                marks = ",".join("?" * len(chunk))
+                for key, blob in conn.execute(f"SELECT key, vec FROM embeddings WHERE key IN ({marks})", chunk):
+                    found[key] = np.frombuffer(blob, dtype="float32")
+            if found:
+                # one UPDATE per lookup keeps eviction LRU, not FIFO
+                hits, now = list(found), time.time()
+                conn.execute("BEGIN")
+                for i in range(0, len(hits), 500):
+                    chunk = hits[i:i+500]
+                    marks = ",".join("?" * len(chunk))
+                    conn.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({marks})", [now] + chunk)
+                conn.execute("COMMIT")
+        except sqlite3.Error:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+    return found
+
+def _disk_put_many(items: Dict[str, np.ndarray]) -> None:
+    global _disk_writes
+    with _disk_lock:
+        conn = _disk()
+        if conn is None or not items:
+            return
+        now = time.time()
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vec, last_used) VALUES (?, ?, ?)",
+                [(k, np.asarray(v, dtype="float32").tobytes(), now) for k, v in items.items()]
+            )
+            if _disk_writes % _TRIM_EVERY == 0:  # also on the first write of a process
+                (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+                if count > CACHE_MAX_ENTRIES:
+                    conn.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                        (count - CACHE_MAX_ENTRIES,)
+                    )
+            conn.execute("COMMIT")
+            _disk_writes += 1
+        except sqlite3.Error:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+
+# -------------------------------
+# Backends (uncached)
+# -------------------------------
+def _embed_openai(texts: List[str], batch_size: int) -> np.ndarray:
+    # concurrent, token-packed and rate-limited; batch_size caps inputs per request
+    from utils.openai_embedding import embed_texts_sync
+    return embed_texts_sync(texts, OPENAI_MODEL, max_inputs=batch_size)
+
+def _embed_local(texts: List[str], batch_size: int) -> np.ndarray:
+    # FastEmbed yields one vector per text; fill a single preallocated matrix
+    emb = _load_fastembed()
+    out: Optional[np.ndarray] = None
+    for i, vec in enumerate(emb.embed(texts, batch_size=batch_size)):
+        if out is None:
+            out = np.empty((len(texts), len(vec)), dtype="float32")
+        out[i] = vec
+    return out if out is not None else np.zeros((0, 0), dtype="float32")
+
+def _embed_backend(texts: List[str], batch_size: int, workers: int = 1) -> np.ndarray:
+    t0 = time.perf_counter()
+    if BACKEND == "openai":
+        vecs = _embed_openai(texts, batch_size)
+    elif workers > 1 and len(texts) >= workers:
+        vecs = _embed_local_parallel(texts, batch_size, workers)
+    else:
+        vecs = _embed_local(texts, batch_size)
+    _throughput["texts"] += len(texts)
+    _throughput["seconds"] += time.perf_counter() - t0
+    return np.asarray(vecs, dtype="float32")
+
+# -------------------------------
+# Parallel local embedding (process pool)
+# -------------------------------
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_throughput = {"texts": 0, "seconds": 0.0}
+
+def _worker_init(threads: int) -> None:
+    _load_fastembed(threads=threads)
+
+def _worker_embed(task) -> np.ndarray:
+    texts, batch_size = task
+    return _embed_local(texts, batch_size)
+
+def _local_pool(workers: int) -> ProcessPoolExecutor:
+    """One long-lived pool per process; every worker loads the model once."""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),  # fresh ONNX runtime per worker
+            initializer=_worker_init, initargs=(threads,),
+        )
+        _pool_workers = workers
+    return _pool
+
+def _embed_local_parallel(texts: List[str], batch_size: int, workers: int) -> np.ndarray:
+    # Every worker gets a shard even when the block is small; on big blocks ~4 shards
+    # per worker (but at most batch_size texts each) balance uneven text lengths.
+    # map() keeps shard order.
+    n = len(texts)
+    shard = max(-(-n // (workers * 4)), min(batch_size, -(-n // workers)))
+    tasks = [(texts[i:i+shard], batch_size) for i in range(0, len(texts), shard)]
+    out: Optional[np.ndarray] = None
+    for i, vecs in zip(range(0, len(texts), shard), _local_pool(workers).map(_worker_embed, tasks)):
+        if out is None:
+            out = np.empty((len(texts), vecs.shape[1]), dtype="float32")
+        out[i:i + len(vecs)] = vecs
+    return out
+
+def bulk_chunk_size(chunk_size: int, batch_size: int = 128, workers: Optional[int] = None) -> int:
+    """Texts per embedded chunk for bulk jobs: at least one full batch per local worker."""
+    workers = (workers or WORKERS) if BACKEND != "openai" else 1
+    return max(chunk_size, workers * batch_size)
+
+def throughput_report() -> str:
+    """Backend texts/sec since process start (cache hits excluded)."""
+    n, secs = _throughput["texts"], _throughput["seconds"]
+    rate = n / secs if secs > 0 else 0.0
+    return f"{n} texts embedded in {secs:.1f}s ({rate:.1f} texts/sec, {model_fingerprint()})"
 
 # -------------------------------
 # Public API
@@ -58,29 +271,93 @@ def _load_openai():
 def get_embedding(text: str) -> np.ndarray:
     return get_embeddings_batch([text])[0]
 
-def get_embeddings_batch(texts: Iterable[str], batch_size: int = 128) -> np.ndarray:
+def normalize_rows(vecs: np.ndarray) -> np.ndarray:
+    """L2-normalize float32 rows in place (also works on a writable np.memmap)."""
+    norms = np.sqrt(np.einsum("ij,ij->i", vecs, vecs, dtype=np.float32))[:, None]
+    np.divide(vecs, norms + 1e-12, out=vecs)
+    return vecs
+
+def _embed_block(texts: List[str], batch_size: int, use_cache: bool, workers: int) -> np.ndarray:
+    """
+    One (rows, dim) float32 block in input order. Cached vectors are reused;
+    duplicate texts are embedded once, so only distinct misses reach the backend.
+    """
+    if not use_cache:
+        return _embed_backend(texts, batch_size, workers)
+
+    keys = [_cache_key(t) for t in texts]
+    found: Dict[str, np.ndarray] = {}
+    for k in keys:
+        if k not in found:
+            vec = _mem_get(k)
+            if vec is not None:
+                found[k] = vec
+
+    pending = [k for k in dict.fromkeys(keys) if k not in found]
+    if pending and CACHE_PATH:
+        from_disk = _disk_get_many(pending)
+        for k, vec in from_disk.items():
+            found[k] = vec
+            _mem_put(k, vec)
+
+    # Distinct misses, in first-seen order
+    miss_keys_seen = set()
+    miss_keys: List[str] = []
+    miss_texts: List[str] = []
+    for k, t in zip(keys, texts):
+        if k not in found and k not in miss_keys_seen:
+            miss_keys_seen.add(k)
+            miss_keys.append(k)
+            miss_texts.append(t)
+
+    if miss_texts:
+        fresh = _embed_backend(miss_texts, batch_size, workers)
+        new_items: Dict[str, np.ndarray] = {}
+        for k, vec in zip(miss_keys, fresh):
+            vec = vec.copy()  # own row, so the cache doesn't pin the whole matrix
+            found[k] = vec
+            new_items[k] = vec
+            _mem_put(k, vec)
+        _disk_put_many(new_items)
+        if len(miss_texts) == len(texts):
+            return fresh  # all distinct misses: the backend matrix already is the block
+
+    block = np.empty((len(texts), len(found[keys[0]])), dtype="float32")
+    for i, k in enumerate(keys):
+        block[i] = found[k]
+    return block
+
+def iter_embeddings(texts: Iterable[str], batch_size: int = 128, chunk_size: int = 4096,
+                    normalize: bool = False, use_cache: bool = True,
+                    workers: Optional[int] = None) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Stream embeddings as (offset, block): block holds rows offset..offset+len(block)
+    of the result, float32, L2-normalized in place if `normalize`. Only one block
+    is alive at a time, so callers can write each straight to disk.
+    """
     texts = [t if isinstance(t, str) else str(t) for t in texts]
+    workers = workers or WORKERS
+    for start in range(0, len(texts), max(1, chunk_size)):
+        block = _embed_block(texts[start:start + chunk_size], batch_size, use_cache, workers)
+        yield start, normalize_rows(block) if normalize else block
 
-    if BACKEND == "openai":
-        client = _load_openai()
-        out: List[np.ndarray] = []
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i+batch_size]
-            for attempt in range(3):
-                try:
-                    r = client.embeddings.create(model=OPENAI_MODEL, input=batch)
-                    out.extend([np.array(d.embedding, dtype="float32") for d in r.data])
-                    break
-                except Exception:
-                    time.sleep(1.0 * (attempt+1))
-                    if attempt == 2:
-                        raise
-        return np.vstack(out).astype("float32")
-
-    # local (FastEmbed)
-    emb = _load_fastembed()
-    vecs: List[np.ndarray] = []
-    for batch_vecs in emb.embed(texts, batch_size=batch_size):
-        arr = np.array(batch_vecs, dtype="float32")
-        vecs.append(arr)
-    return np.vstack(vecs).astype("float32")
+def get_embeddings_batch(texts: Iterable[str], batch_size: int = 128, use_cache: bool = True,
+                         workers: Optional[int] = None, out: Optional[np.ndarray] = None,
+                         normalize: bool = False) -> np.ndarray:
+    """
+    Embed texts in order (see iter_embeddings). `workers` > 1 shards local
+    (FastEmbed) embedding across processes. With `out` (a preallocated
+    (len(texts), dim) array or writable np.memmap) rows are written into it block
+    by block and `out` is returned; no full-size temporary is built.
+    """
+    texts = [t if isinstance(t, str) else str(t) for t in texts]
+    if out is None:
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+        return next(iter_embeddings(texts, batch_size, len(texts), normalize, use_cache, workers))[1]
+    if len(out) != len(texts):
+        raise ValueError(f"out has {len(out)} rows for {len(texts)} texts")
+    for start, block in iter_embeddings(texts, batch_size, normalize=normalize,
+                                        use_cache=use_cache, workers=workers):
+        out[start:start + len(block)] = block
+    return out
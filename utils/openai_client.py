@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+utils/openai_client.py
+One sync OpenAI client per process for the engine (12.py) and the ingest
+localization step (ingest_index_json.py), built the same way in both: explicit
+httpx client, proxy taken from HTTPS_PROXY / HTTP_PROXY / ALL_PROXY, no
+proxy-env side effects.
+"""
+
+from __future__ import annotations
+import os, threading
+from typing import Optional
+
+import httpx
+from packaging import version
+from openai import OpenAI
+
+# ---------------------------
+# HTTPX client helper (handles 0.27 vs 0.28+)
+# ---------------------------
+def make_httpx_client(proxy: Optional[str], timeout: float = 90.0) -> httpx.Client:
+    """
+    Create an httpx.Client that works across httpx versions.
+    httpx 0.28+ uses 'proxy='; 0.27- uses 'proxies='.
+    """
+    kw = "proxy" if version.parse(httpx.__version__) >= version.parse("0.28.0") else "proxies"
+    kwargs = {"timeout": timeout}
+    if proxy:
+        kwargs[kw] = proxy
+    try:
+        return httpx.Client(**kwargs)
+    except TypeError:
+        # Fallback if the current httpx doesn't support the chosen kw
+        kwargs.pop(kw, None)
+        alt_kw = "proxies" if kw == "proxy" else "proxy"
+        if proxy:
+            kwargs[alt_kw] = proxy
+        return httpx.Client(**kwargs)
+
+# ---------------------------
+# OpenAI client (singleton)
+# ---------------------------
+_OPENAI_CLIENT: Optional[OpenAI] = None
+
+_client_lock = threading.Lock()
+
+def openai_client() -> OpenAI:
+    global _OPENAI_CLIENT
+    if _OPENAI_CLIENT is not None:
+        return _OPENAI_CLIENT
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY not set.")
+
+    with _client_lock:
+        if _OPENAI_CLIENT is None:
+            proxy = os.getenv("HTTPS_PROXY") or os.getenv("HTTP_PROXY") or os.getenv("ALL_PROXY")
+            http_client = make_httpx_client(proxy, timeout=90.0)
+            _OPENAI_CLIENT = OpenAI(api_key=api_key, http_client=http_client)
+    return _OPENAI_CLIENT
+
+def has_japanese(text: str) -> bool:
+    if not text:
+        return False
+    return any('\u3040' <= c <= '\u309F' or
+               '\u30A0' <= c <= '\u30FF' or
+               '\u4E00' <= c <= '\u9FAF' for c in text)
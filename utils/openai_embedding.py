@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+utils/openai_embedding.py
+Async OpenAI embeddings for EMBEDDING_BACKEND=openai (used via utils/embedding.py).
+
+- Texts are packed into batches by estimated token count (tiktoken if installed,
+  else ~4 chars/token), capped at OPENAI_EMBED_BATCH_TOKENS and the caller's
+  max inputs per batch.
+- Up to OPENAI_EMBED_CONCURRENCY batches are in flight at once.
+- A token bucket keeps requests/min and tokens/min under OPENAI_EMBED_RPM /
+  OPENAI_EMBED_TPM across all in-flight batches.
+- Only retryable failures (429, 408/409, 5xx, connection errors, timeouts) are
+  retried, with jittered exponential backoff (Retry-After is honored); anything
+  else (bad input, auth) raises at once.
+- Results are written back by input position, so order is preserved.
+
+embed_texts() is the async API. embed_texts_sync() runs it on one background
+event loop per process, so sync callers on any thread share one AsyncOpenAI
+client and its warm connections.
+"""
+
+from __future__ import annotations
+import os, time, random, asyncio, threading
+from typing import List, Optional, Tuple
+import numpy as np
+
+# -------------------------------
+# Config
+# -------------------------------
+CONCURRENCY = int(os.getenv("OPENAI_EMBED_CONCURRENCY", "4"))
+RPM = float(os.getenv("OPENAI_EMBED_RPM", "3000"))
+TPM = float(os.getenv("OPENAI_EMBED_TPM", "1000000"))
+BATCH_TOKENS = int(os.getenv("OPENAI_EMBED_BATCH_TOKENS", "100000"))  # API limit is 300k/request
+MAX_INPUTS = 2048  # API limit per request
+MAX_RETRIES = int(os.getenv("OPENAI_EMBED_MAX_RETRIES", "6"))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# -------------------------------
+# Token counting (optional tiktoken)
+# -------------------------------
+_encoder = None
+_encoder_loaded = False
+
+def count_tokens(text: str, model: str) -> int:
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        try:
+            import tiktoken
+            try:
+                _encoder = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encoder = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encoder = None
+    if _encoder is not None:
+        return len(_encoder.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+def plan_batches(texts: List[str], model: str, max_inputs: int,
+                 max_tokens: int = BATCH_TOKENS) -> List[Tuple[int, int, int]]:
+    """Contiguous (start, end, tokens) batches under both the input and the token cap."""
+    max_inputs = max(1, min(max_inputs, MAX_INPUTS))
+    batches: List[Tuple[int, int, int]] = []
+    start, tokens = 0, 0
+    for i, text in enumerate(texts):
+        n = count_tokens(text, model)
+        if i > start and (i - start >= max_inputs or tokens + n > max_tokens):
+            batches.append((start, i, tokens))
+            start, tokens = i, 0
+        tokens += n
+    if start < len(texts):
+        batches.append((start, len(texts), tokens))
+    return batches
+
+# -------------------------------
+# Rate limiting
+# -------------------------------
+class TokenBucket:
+    """Requests/min + tokens/min buckets, refilled continuously; acquire() waits for both."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.rpm, self.tpm = rpm, tpm
+        self.requests, self.tokens = rpm, tpm
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed, self.updated = now - self.updated, now
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60.0)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60.0)
+
+    async def acquire(self, tokens: int) -> None:
+        tokens = min(tokens, self.tpm)  # a batch above the whole budget waits for a full bucket
+        async with self.lock:  # FIFO: one waiter drains the bucket at a time
+            while True:
+                self._refill()
+                if self.requests >= 1 and self.tokens >= tokens:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return
+                wait = max((1 - self.requests) * 60.0 / self.rpm, (tokens - self.tokens) * 60.0 / self.tpm)
+                await asyncio.sleep(max(wait, 0.01))
+
+# -------------------------------
+# Retry policy
+# -------------------------------
+def _retry_after(err: Exception) -> Optional[float]:
+    response = getattr(err, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(err: Exception) -> bool:
+    import openai
+    if isinstance(err, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return True  # APITimeoutError is an APIConnectionError
+    if isinstance(err, openai.APIStatusError):
+        return err.status_code in (408, 409, 429) or err.status_code >= 500
+    return False
+
+def backoff_delay(attempt: int, err: Optional[Exception] = None) -> float:
+    """Full-jitter exponential backoff; a server Retry-After wins if it is longer."""
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+    hinted = _retry_after(err) if err is not None else None
+    return max(delay, hinted) if hinted else delay
+
+# -------------------------------
+# Async API
+# -------------------------------
+def _new_client():
+    from openai import AsyncOpenAI
+    key = os.getenv("OPENAI_API_KEY")
+    if not key:
+        raise RuntimeError("OPENAI_API_KEY is not set (required for EMBEDDING_BACKEND=openai).")
+    return AsyncOpenAI(api_key=key, max_retries=0)  # retries are handled here
+
+async def _embed_batch(client, limiter: TokenBucket, model: str, batch: List[str], tokens: int) -> List[List[float]]:
+    for attempt in range(MAX_RETRIES + 1):
+        await limiter.acquire(tokens)
+        try:
+            r = await client.embeddings.create(model=model, input=batch)
+            return [d.embedding for d in sorted(r.data, key=lambda d: d.index)]
+        except Exception as e:
+            if attempt == MAX_RETRIES or not is_retryable(e):
+                raise
+            await asyncio.sleep(backoff_delay(attempt, e))
+
+async def embed_texts(texts: List[str], model: str, max_inputs: int = 128, client=None,
+                      limiter: Optional[TokenBucket] = None, concurrency: int = CONCURRENCY) -> np.ndarray:
+    """Embed texts with bounded concurrency; row i of the result belongs to texts[i]."""
+    if not texts:
+        return np.zeros((0, 0), dtype="float32")
+    own_client = client is None
+    client = client or _new_client()
+    limiter = limiter or TokenBucket(RPM, TPM)
+    gate = asyncio.Semaphore(max(1, concurrency))
+    out: Optional[np.ndarray] = None
+
+    async def run(start: int, end: int, tokens: int) -> None:
+        nonlocal out
+        async with gate:
+            vecs = await _embed_batch(client, limiter, model, texts[start:end], tokens)
+        if out is None:
+            out = np.empty((len(texts), len(vecs[0])), dtype="float32")
+        out[start:end] = vecs
+
+    tasks = [asyncio.ensure_future(run(*b)) for b in plan_batches(texts, model, max_inputs)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()  # stop spending quota on a call that already failed
+        raise
+    finally:
+        if own_client:
+            await client.close()
+    return out
+
+# -------------------------------
+# Sync wrapper (background event loop, one per process)
+# -------------------------------
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_pid: Optional[int] = None
+_loop_lock = threading.Lock()
+_shared: dict = {}
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _shared.clear()
+            threading.Thread(target=_loop.run_forever, name="openai-embed", daemon=True).start()
+    return _loop
+
+async def _embed_shared(texts: List[str], model: str, max_inputs: int) -> np.ndarray:
+    # client + limiter live on the background loop and are shared by all callers
+    if "client" not in _shared:
+        _shared["client"] = _new_client()
+        _shared["limiter"] = TokenBucket(RPM, TPM)
+    return await embed_texts(texts, model, max_inputs, client=_shared["client"], limiter=_shared["limiter"])
+
+def embed_texts_sync(texts: List[str], model: str, max_inputs: int = 128) -> np.ndarray:
+    """Blocking wrapper for existing callers; safe from any thread, including inside a running loop."""
+    future = asyncio.run_coroutine_threadsafe(_embed_shared(texts, model, max_inputs), _background_loop())
+    return future.result()
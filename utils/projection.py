@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+utils/projection.py
+Reduced-dimension vectors for faster search (numpy only, so api/index.py can use it).
+
+Full-width, L2-normalized embeddings are mapped to `dim` dims and renormalized:
+  truncate   keep the first `dim` components (Matryoshka-style; equivalent to the
+             OpenAI `dimensions` parameter for text-embedding-3-*)
+  pca        rotate onto the top principal axes of a doc sample, then keep `dim`.
+             Works for models that were not trained for truncation (bge-small).
+
+The PCA axes are fitted centered (top eigenvectors of the docs' covariance) but
+applied uncentered: vectors are rotated as they are, no mean is subtracted. The
+matrix is orthonormal, so at full width it is a pure rotation and inner products
+are unchanged; at lower widths it keeps the directions along which the docs
+actually differ and drops most of the component they all share.
+
+A build saves its projection with its vectors (proj.npz in the bundle, see
+utils/bundle.py). Query vectors must go through the same file, or they won't be
+comparable with the index.
+
+Build defaults:
+  EMBEDDING_DIM=0          target dim, 0 = full width
+  EMBEDDING_REDUCE=pca     pca | truncate
+"""
+
+from __future__ import annotations
+import os
+from typing import Any, Dict, Optional
+import numpy as np
+
+DIM = int(os.getenv("EMBEDDING_DIM", "0"))
+METHOD = os.getenv("EMBEDDING_REDUCE", "pca").lower()
+METHODS = ("pca", "truncate")
+
+def projection_path(vectors_path: str) -> str:
+    return os.path.splitext(vectors_path)[0] + ".proj.npz"
+
+def _normalize_rows(vecs: np.ndarray) -> np.ndarray:
+    norms = np.sqrt(np.einsum("ij,ij->i", vecs, vecs, dtype=np.float32))[:, None]
+    np.divide(vecs, norms + 1e-12, out=vecs)
+    return vecs
+
+class Projection:
+    """dim_in -> dim map applied identically to docs (at build) and queries (at search)."""
+
+    def __init__(self, method: str, dim_in: int, dim: int, matrix: Optional[np.ndarray] = None):
+        self.method, self.dim_in, self.dim = method, int(dim_in), int(dim)
+        self.matrix = matrix  # (dim, dim_in) float32 for pca
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, dim: int, method: str = METHOD,
+            sample: int = 100000, block: int = 8192) -> "Projection":
+        """Fit on (up to `sample` rows of) normalized vectors; PCA needs one pass over the sample."""
+        dim_in = int(vectors.shape[1])
+        if not 0 < dim < dim_in:
+            raise ValueError(f"Reduced dim must be between 1 and {dim_in - 1}, got {dim}")
+        if method not in METHODS:
+            raise ValueError(f"Unknown reduction '{method}' (use one of {METHODS})")
+        if method == "truncate":
+            return cls(method, dim_in, dim)
+
+        rows = np.arange(len(vectors))
+        if len(vectors) > sample:
+            rows = np.linspace(0, len(vectors) - 1, sample).astype("int64")
+        # Covariance accumulated block by block: memory is dim_in^2, not sample x dim_in
+        total = np.zeros(dim_in, dtype="float64")
+        gram = np.zeros((dim_in, dim_in), dtype="float64")
+        for start in range(0, len(rows), block):
+            x = np.asarray(vectors[rows[start:start + block]], dtype="float64")
+            total += x.sum(axis=0)
+            gram += x.T @ x
+        mean = total / max(1, len(rows))
+        cov = gram / max(1, len(rows)) - np.outer(mean, mean)
+        _, eigvecs = np.linalg.eigh(cov)  # ascending eigenvalues; apply() does not center
+        matrix = np.ascontiguousarray(eigvecs[:, ::-1][:, :dim].T, dtype="float32")
+        return cls(method, dim_in, dim, matrix)
+
+    def apply(self, vecs: np.ndarray) -> np.ndarray:
+        """Project one vector or a (n, dim_in) block; rows come back L2-normalized."""
+        v = np.asarray(vecs, dtype="float32")
+        single = v.ndim == 1
+        v = np.atleast_2d(v)
+        if v.shape[1] != self.dim_in:
+            raise ValueError(f"Vector has {v.shape[1]} dims, projection expects {self.dim_in}. "
+                             f"Was the index built with a different embedding model?")
+        if self.method == "truncate":
+            out = np.array(v[:, :self.dim], dtype="float32")
+        else:
+            out = v @ self.matrix.T
+        out = _normalize_rows(out)
+        return out[0] if single else out
+
+    def apply_to_npy(self, vectors: np.ndarray, path: str, dtype: str = "float32",
+                     block: int = 65536) -> np.ndarray:
+        """Project memory-mapped vectors block by block into a .npy; returns it mapped read-only."""
+        tmp = path + ".tmp"
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=(len(vectors), self.dim))
+        for start in range(0, len(vectors), block):
+            out[start:start + block] = self.apply(vectors[start:start + block])
+        out.flush()
+        del out
+        os.replace(tmp, path)
+        return np.load(path, mmap_mode="r")
+
+    def describe(self) -> Dict[str, Any]:
+        return {"method": self.method, "dim_in": self.dim_in, "dim": self.dim}
+
+    def save(self, path: str) -> None:
+        tmp = path + ".tmp"
+        arrays = {"method": np.array(self.method), "dim_in": np.array(self.dim_in), "dim": np.array(self.dim)}
+        if self.matrix is not None:
+            arrays["matrix"] = self.matrix
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["Projection"]:
+        """The saved projection, or None when the build kept full-width vectors."""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            matrix = data["matrix"] if "matrix" in data.files else None
+            return cls(str(data["method"]), int(data["dim_in"]), int(data["dim"]), matrix)
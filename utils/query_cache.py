@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+utils/query_cache.py
+Two-tier cache for the serverless handler (api/index.py): query embeddings,
+ja->en brief translations and whole /api/retrieve + /api/generate responses.
+
+  memory   LRU of QUERY_CACHE_MEM_ENTRIES per warm instance
+  /tmp     one file per entry under QUERY_CACHE_DIR, shared by every invocation
+           (and instance) that sees the same filesystem; written atomically
+
+Entries expire after QUERY_CACHE_TTL seconds in both tiers. The directory is
+trimmed (expired first, then oldest) to QUERY_CACHE_MAX_MB every few writes.
+Keys are sha256 of the kind plus all key parts; briefs are normalized with
+normalize_text() first, so whitespace/width variants share an entry.
+
+Env:
+  QUERY_CACHE_DIR=/tmp/query_cache   ("" or "off" disables both tiers)
+  QUERY_CACHE_TTL=86400
+  QUERY_CACHE_MAX_MB=64
+  QUERY_CACHE_MEM_ENTRIES=256
+"""
+
+from __future__ import annotations
+import os, json, time, hashlib, threading, unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+
+# -------------------------------
+# Config
+# -------------------------------
+CACHE_DIR = os.getenv("QUERY_CACHE_DIR", "/tmp/query_cache")
+TTL = float(os.getenv("QUERY_CACHE_TTL", "86400"))
+MAX_BYTES = int(float(os.getenv("QUERY_CACHE_MAX_MB", "64")) * 1024 * 1024)
+MEM_ENTRIES = int(os.getenv("QUERY_CACHE_MEM_ENTRIES", "256"))
+_TRIM_EVERY = 50  # check the size bound every N disk writes
+
+_mem: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()  # key -> (expires_at, value)
+_lock = threading.Lock()
+_writes = 0
+_counts: Dict[str, Dict[str, int]] = {}
+
+def _enabled() -> bool:
+    return bool(CACHE_DIR) and CACHE_DIR.lower() != "off"
+
+def normalize_text(text: str) -> str:
+    """NFKC + collapsed whitespace: full-width and spacing variants of a brief share a key."""
+    return " ".join(unicodedata.normalize("NFKC", text or "").split())
+
+def cache_key(kind: str, *parts: Any) -> str:
+    h = hashlib.sha256()
+    for part in (kind,) + parts:
+        h.update(json.dumps(part, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def _count(kind: str, outcome: str) -> None:
+    counts = _counts.setdefault(kind, {"mem_hits": 0, "disk_hits": 0, "misses": 0})
+    counts[outcome] += 1
+
+def _remember(key: str, value: Any, expires_at: float) -> None:
+    _mem[key] = (expires_at, value)
+    _mem.move_to_end(key)
+    while len(_mem) > MEM_ENTRIES:
+        _mem.popitem(last=False)
+
+# -------------------------------
+# Disk tier
+# -------------------------------
+def _paths(key: str) -> Tuple[str, str]:
+    base = os.path.join(CACHE_DIR, key[:2], key)
+    return base + ".npy", base + ".json"
+
+def _read_disk(key: str) -> Tuple[Optional[Any], float]:
+    """(value, expires_at) of a live file entry, or (None, 0)."""
+    for path in _paths(key):
+        try:
+            expires_at = os.path.getmtime(path) + TTL
+            if expires_at <= time.time():
+                os.remove(path)
+                continue
+            if path.endswith(".npy"):
+                return np.load(path), expires_at
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f), expires_at
+        except (OSError, ValueError):
+            continue
+    return None, 0.0
+
+def _write_disk(key: str, value: Any) -> None:
+    global _writes
+    npy_path, json_path = _paths(key)
+    path = npy_path if isinstance(value, np.ndarray) else json_path
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "wb") as f:
+            if isinstance(value, np.ndarray):
+                np.save(f, value)
+            else:
+                f.write(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        os.replace(tmp, path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"⚠️ Query cache write failed ({CACHE_DIR}): {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return
+    _writes += 1
+    if _writes % _TRIM_EVERY == 1:  # also on the first write of a fresh instance
+        trim()
+
+def trim(max_bytes: int = MAX_BYTES) -> int:
+    """Delete expired entries, then the oldest until the directory fits max_bytes. Returns files removed."""
+    entries, total, removed = [], 0, 0
+    now = time.time()
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if st.st_mtime + TTL <= now or name.endswith(".tmp") and st.st_mtime + 60 <= now:
+                removed += _remove(path)
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        removed += _remove(path)
+        total -= size
+    return removed
+
+def _remove(path: str) -> int:
+    try:
+        os.remove(path)
+        return 1
+    except OSError:
+        return 0
+
+# -------------------------------
+# Public API
+# -------------------------------
+def get(kind: str, key: str) -> Optional[Any]:
+    """Cached value (ndarray or JSON data) or None; counts a hit per tier or a miss under `kind`."""
+    if not _enabled():
+        return None
+    with _lock:
+        hit = _mem.get(key)
+        if hit is not None and hit[0] > time.time():
+            _mem.move_to_end(key)
+            _count(kind, "mem_hits")
+            return hit[1]
+        value, expires_at = _read_disk(key)
+        if value is None:
+            _mem.pop(key, None)
+            _count(kind, "misses")
+            return None
+        _remember(key, value, expires_at)
+        _count(kind, "disk_hits")
+        return value
+
+def put(kind: str, key: str, value: Any) -> None:
+    """Store an ndarray or JSON-serializable value in both tiers (callers must not mutate it afterwards)."""
+    if not _enabled() or value is None:
+        return
+    with _lock:
+        _remember(key, value, time.time() + TTL)
+        _write_disk(key, value)
+
+def stats() -> Dict[str, Any]:
+    """Hit/miss counters of this instance per kind, for /api/health."""
+    with _lock:
+        out: Dict[str, Any] = {"enabled": _enabled(), "memory_entries": len(_mem)}
+        for kind, c in _counts.items():
+            lookups = c["mem_hits"] + c["disk_hits"] + c["misses"]
+            out[kind] = dict(c, hit_rate=round((lookups - c["misses"]) / lookups, 3) if lookups else None)
+        return out
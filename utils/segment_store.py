@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+utils/segment_store.py
+Columnar, memory-mapped segment store shared by 12.py, app.py and api/index.py.
+
+One SegmentStore replaces the list of per-segment dicts:
+  key_ids      int32[n]     segment -> interned keyword ID
+  keywords     <U[k]        interned keyword table (one copy per distinct keyword)
+  jp_names     list[k]      Japanese name per keyword, resolved once from japan.json
+  text         uint8[...]   every segment's text in one UTF-8 buffer, + text_offsets int64[n+1]
+  snippet_ja   uint8[...]   precomputed Japanese snippet (may be empty), + offsets
+  terms        TermIndex    per-segment token IDs for keyword-hit scoring
+
+Layout next to a docs JSONL file (e.g. Data/docs2.jsonl), written by write_docs():
+  docs2.jsonl          one JSON object per line (format unchanged, still the source of truth)
+  docs2.store/*.npy    the columns above + offsets (byte offset of every JSONL line)
+  docs2.store/source.json  size + mtime_ns of the JSONL the columns were built from
+
+Every column is opened with mmap, so startup is O(1) and pages are shared across
+worker processes through the OS page cache. If the store is missing or stale (the
+JSONL changed after it was written), open() parses the JSONL and builds the same
+columns in memory instead.
+"""
+
+from __future__ import annotations
+import os, re, json, mmap
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional
+import numpy as np
+
+# -------------------------------
+# Tokenization (keyword-hit scoring)
+# -------------------------------
+def tokenize_lower(s: str) -> set:
+    if not s:
+        return set()
+    english_terms = set(re.findall(r"[a-zA-Z0-9\-\+/#\.]+", s.lower()))
+    japanese_terms = set(re.findall(r"[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]+", s))
+    return english_terms | japanese_terms
+
+def doc_keyword(rec: dict, idx: int) -> str:
+    return rec.get("keyword") or f"seg_{idx}"
+
+def doc_text(rec: dict) -> str:
+    return (rec.get("text") or rec.get("answer") or "")
+
+class TermIndex:
+    """
+    Per-doc token sets (keyword + text, English and Japanese runs) tokenized once.
+    Tokens are interned to IDs assigned in sorted order, and each doc holds a
+    sorted int32 slice of one flat array, so a hit list is an array
+    intersection whose ID order is already the sorted token order.
+    """
+    __slots__ = ("tokens", "offsets", "ids")
+
+    def __init__(self, tokens: np.ndarray, offsets: np.ndarray, ids: np.ndarray):
+        self.tokens = tokens    # sorted unicode array; position == token ID
+        self.offsets = offsets
+        self.ids = ids
+
+    @classmethod
+    def from_docs(cls, docs: List[dict]) -> "TermIndex":
+        per_doc = [tokenize_lower(doc_text(rec)) | tokenize_lower(doc_keyword(rec, idx))
+                   for idx, rec in enumerate(docs)]
+        tokens = sorted(set().union(*per_doc)) if per_doc else []
+        token_ids = {t: i for i, t in enumerate(tokens)}
+        offsets = np.zeros(len(per_doc) + 1, dtype="int64")
+        chunks = []
+        for i, terms in enumerate(per_doc):
+            chunk = np.array(sorted(token_ids[t] for t in terms), dtype="int32")
+            chunks.append(chunk)
+            offsets[i + 1] = offsets[i] + len(chunk)
+        ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype="int32")
+        return cls(np.array(tokens, dtype="U") if tokens else np.zeros(0, dtype="U1"), offsets, ids)
+
+    def lookup(self, terms: set) -> np.ndarray:
+        """Sorted IDs of the query terms that occur anywhere in the corpus."""
+        if not terms or not len(self.tokens):
+            return np.zeros(0, dtype="int32")
+        query = np.array(sorted(terms), dtype="U")
+        pos = np.searchsorted(self.tokens, query)
+        inside = pos < len(self.tokens)
+        pos, query = pos[inside], query[inside]
+        return pos[self.tokens[pos] == query].astype("int32")
+
+    def hits(self, doc_idx: int, query_ids: np.ndarray) -> List[str]:
+        """Sorted tokens shared by the doc and the query."""
+        if not len(query_ids):
+            return []
+        doc_ids = self.ids[self.offsets[doc_idx]:self.offsets[doc_idx + 1]]
+        common = np.intersect1d(doc_ids, query_ids, assume_unique=True)
+        return [str(t) for t in self.tokens[common]]
+
+# -------------------------------
+# Column helpers
+# -------------------------------
+def _pack_strings(values: List[str]):
+    """List of str -> (uint8 UTF-8 buffer, int64[n+1] offsets)."""
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype="int64")
+    if encoded:
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+    buf = np.frombuffer(b"".join(encoded), dtype="uint8") if encoded else np.zeros(0, dtype="uint8")
+    return buf, offsets
+
+def _line_offsets(lines: List[bytes]) -> np.ndarray:
+    offsets = np.zeros(len(lines) + 1, dtype="int64")
+    if lines:
+        offsets[1:] = np.cumsum([len(l) for l in lines])
+    return offsets
+
+def _store_dir(path: str) -> str:
+    return os.path.splitext(path)[0] + ".store"
+
+_COLUMNS = ("offsets", "key_ids", "keywords", "text", "text_offsets", "snippet_ja",
+            "snippet_ja_offsets", "term_vocab", "term_offsets", "term_ids")
+
+_SOURCE = "source.json"
+
+def _source_stamp(path: str) -> Dict[str, int]:
+    # A rename (write_docs' tmp -> JSONL) keeps mtime, a rewrite in place does not
+    st = os.stat(path)
+    return {"size": int(st.st_size), "mtime_ns": int(st.st_mtime_ns)}
+
+def _save_npy(path: str, arr: np.ndarray) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+# -------------------------------
+# SegmentStore
+# -------------------------------
+class SegmentStore:
+    """Segments by integer ID; columns are numpy arrays (mmapped when opened from disk)."""
+
+    def __init__(self, cols: Dict[str, np.ndarray], path: Optional[str] = None,
+                 japan_map: Optional[Dict[str, str]] = None):
+        self.path = path
+        self.offsets = cols["offsets"]
+        self.key_ids = cols["key_ids"]
+        self.keywords = cols["keywords"]
+        self._text, self._text_offsets = cols["text"], cols["text_offsets"]
+        self._snip, self._snip_offsets = cols["snippet_ja"], cols["snippet_ja_offsets"]
+        self.terms = TermIndex(cols["term_vocab"], cols["term_offsets"], cols["term_ids"])
+        self._mm = None
+        self.set_japan_map(japan_map or {})
+
+    # ---- construction ----
+    @staticmethod
+    def _columns(docs: List[dict], lines: List[bytes]) -> Dict[str, np.ndarray]:
+        table: Dict[str, int] = {}
+        key_ids = np.empty(len(docs), dtype="int32")
+        for idx, rec in enumerate(docs):
+            key_ids[idx] = table.setdefault(doc_keyword(rec, idx), len(table))
+        text, text_offsets = _pack_strings([doc_text(rec) for rec in docs])
+        snip, snip_offsets = _pack_strings([rec.get("snippet_ja") or "" for rec in docs])
+        terms = TermIndex.from_docs(docs)
+        return {
+            "offsets": _line_offsets(lines),
+            "key_ids": key_ids,
+            "keywords": np.array(list(table), dtype="U") if table else np.zeros(0, dtype="U1"),
+            "text": text, "text_offsets": text_offsets,
+            "snippet_ja": snip, "snippet_ja_offsets": snip_offsets,
+            "term_vocab": terms.tokens, "term_offsets": terms.offsets, "term_ids": terms.ids,
+        }
+
+    @classmethod
+    def open(cls, path: str, japan_map: Optional[Dict[str, str]] = None) -> "SegmentStore":
+        """Map <stem>.store/ if it matches the JSONL, else parse the JSONL into memory."""
+        store_dir = _store_dir(path)
+        paths = {name: os.path.join(store_dir, name + ".npy") for name in _COLUMNS}
+        if all(os.path.exists(p) for p in paths.values()) and _store_matches(store_dir, path):
+            cols = {name: np.load(p, mmap_mode="r") for name, p in paths.items()}
+            n = len(cols["offsets"]) - 1
+            if (cols["offsets"][-1] == os.path.getsize(path) and len(cols["key_ids"]) == n
+                    and len(cols["text_offsets"]) == n + 1 and len(cols["term_offsets"]) == n + 1):
+                return cls(cols, path, japan_map)
+
+        with open(path, "rb") as f:
+            lines = f.readlines()
+        docs = [json.loads(l) for l in lines]
+        return cls(cls._columns(docs, lines), path, japan_map)
+
+    @classmethod
+    def from_keywords(cls, keywords: List[str], japan_map: Optional[Dict[str, str]] = None) -> "SegmentStore":
+        """Names-only store (no text) for data that ships just a keywords.json list."""
+        docs = [{"keyword": k} for k in keywords]
+        lines = [json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n" for rec in docs]
+        return cls(cls._columns(docs, lines), None, japan_map)
+
+    def set_japan_map(self, japan_map: Dict[str, str]) -> None:
+        """Resolve the Japanese name of every distinct keyword once (falls back to the keyword)."""
+        self.jp_names = [japan_map.get(k, k) for k in map(str, self.keywords)]
+
+    # ---- access by segment ID ----
+    def __len__(self) -> int:
+        return len(self.key_ids)
+
+    def keyword(self, idx: int) -> str:
+        return str(self.keywords[self.key_ids[idx]])
+
+    def jp_name(self, idx: int) -> str:
+        return self.jp_names[self.key_ids[idx]]
+
+    def text(self, idx: int) -> str:
+        return bytes(self._text[self._text_offsets[idx]:self._text_offsets[idx + 1]]).decode("utf-8")
+
+    def snippet_ja(self, idx: int) -> Optional[str]:
+        raw = bytes(self._snip[self._snip_offsets[idx]:self._snip_offsets[idx + 1]])
+        return raw.decode("utf-8") if raw else None
+
+    def record(self, idx: int) -> dict:
+        """Full JSONL record, for fields that have no column."""
+        if self._mm is None:
+            with open(self.path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return json.loads(self._mm[self.offsets[idx]:self.offsets[idx + 1]])
+
+    def __iter__(self) -> Iterator[dict]:
+        for i in range(len(self)):
+            yield self.record(i)
+
+# -------------------------------
+# Writing
+# -------------------------------
+_COPY_BLOCK = 1 << 22  # elements per block when copying scratch files
+
+def _raw_to_npy(raw_path: str, path: str, dtype: str) -> None:
+    """Copy a raw scratch file into a .npy in blocks (never loads it whole)."""
+    n = os.path.getsize(raw_path) // np.dtype(dtype).itemsize
+    tmp = path + ".tmp"
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=(n,))
+    if n:
+        src = np.memmap(raw_path, dtype=dtype, mode="r", shape=(n,))
+        for start in range(0, n, _COPY_BLOCK):
+            out[start:start + _COPY_BLOCK] = src[start:start + _COPY_BLOCK]
+        del src
+    out.flush()
+    del out
+    os.replace(tmp, path)
+    os.remove(raw_path)
+
+def _finish_term_ids(raw_path: str, path: str, term_offsets: np.ndarray, remap: np.ndarray) -> None:
+    """Renumber provisional token IDs to sorted-vocab IDs and sort each doc's slice."""
+    total = int(term_offsets[-1])
+    tmp = path + ".tmp"
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype="int32", shape=(total,))
+    if total:
+        src = np.memmap(raw_path, dtype="int32", mode="r", shape=(total,))
+        n, block = len(term_offsets) - 1, 1 << 16
+        for d0 in range(0, n, block):
+            d1 = min(n, d0 + block)
+            s, e = int(term_offsets[d0]), int(term_offsets[d1])
+            ids = remap[src[s:e]]
+            doc = np.repeat(np.arange(d1 - d0), np.diff(term_offsets[d0:d1 + 1]))
+            out[s:e] = ids[np.lexsort((ids, doc))]
+        del src
+    out.flush()
+    del out
+    os.replace(tmp, path)
+    os.remove(raw_path)
+
+def write_store(path: str, source: Optional[str] = None) -> None:
+    """
+    Build <stem>.store/ for the JSONL at `source` (default: `path` itself), one
+    line at a time. Memory holds the keyword/token tables and per-doc offsets;
+    text and token IDs go through scratch files, so large corpora stream.
+    """
+    source = source or path
+    store_dir = _store_dir(path)
+    os.makedirs(store_dir, exist_ok=True)
+    raw = {name: os.path.join(store_dir, name + ".raw") for name in ("text", "snippet_ja", "term_ids")}
+    scratch = {name: open(p, "wb") for name, p in raw.items()}
+
+    offsets, text_offsets, snip_offsets, term_offsets = (array("q", [0]) for _ in range(4))
+    key_ids = array("i")
+    table: Dict[str, int] = {}
+    vocab: Dict[str, int] = {}
+    try:
+        with open(source, "rb") as f:
+            for idx, line in enumerate(f):
+                rec = json.loads(line)
+                offsets.append(offsets[-1] + len(line))
+                key, text = doc_keyword(rec, idx), doc_text(rec)
+                key_ids.append(table.setdefault(key, len(table)))
+                for name, value, offs in (("text", text, text_offsets),
+                                          ("snippet_ja", rec.get("snippet_ja") or "", snip_offsets)):
+                    data = value.encode("utf-8")
+                    scratch[name].write(data)
+                    offs.append(offs[-1] + len(data))
+                ids = array("i", (vocab.setdefault(t, len(vocab)) for t in tokenize_lower(text) | tokenize_lower(key)))
+                scratch["term_ids"].write(ids.tobytes())
+                term_offsets.append(term_offsets[-1] + len(ids))
+    finally:
+        for fh in scratch.values():
+            fh.close()
+
+    tokens = sorted(vocab)
+    remap = np.empty(len(tokens), dtype="int32")
+    remap[np.array([vocab[t] for t in tokens], dtype="int64")] = np.arange(len(tokens), dtype="int32")
+    col = lambda name: os.path.join(store_dir, name + ".npy")
+    term_offsets_arr = np.frombuffer(term_offsets, dtype="int64")
+
+    _raw_to_npy(raw["text"], col("text"), "uint8")
+    _raw_to_npy(raw["snippet_ja"], col("snippet_ja"), "uint8")
+    _finish_term_ids(raw["term_ids"], col("term_ids"), term_offsets_arr, remap)
+    _save_npy(col("term_vocab"), np.array(tokens, dtype="U") if tokens else np.zeros(0, dtype="U1"))
+    _save_npy(col("term_offsets"), term_offsets_arr)
+    _save_npy(col("text_offsets"), np.frombuffer(text_offsets, dtype="int64"))
+    _save_npy(col("snippet_ja_offsets"), np.frombuffer(snip_offsets, dtype="int64"))
+    _save_npy(col("keywords"), np.array(list(table), dtype="U") if table else np.zeros(0, dtype="U1"))
+    _save_npy(col("key_ids"), np.frombuffer(key_ids, dtype="int32"))
+    tmp = os.path.join(store_dir, _SOURCE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(_source_stamp(source), f)
+    os.replace(tmp, os.path.join(store_dir, _SOURCE))
+    _save_npy(col("offsets"), np.frombuffer(offsets, dtype="int64"))  # last: marks the store complete
+
+def _store_matches(store_dir: str, path: str) -> bool:
+    """True if the store was built from the JSONL as it is now (same size and mtime)."""
+    try:
+        with open(os.path.join(store_dir, _SOURCE), "r", encoding="utf-8") as f:
+            return json.load(f) == _source_stamp(path)
+    except (OSError, ValueError):
+        return False
+
+def write_docs(path: str, docs: Iterable[dict]) -> None:
+    """
+    Atomically write the JSONL plus its store. The JSONL is replaced last, so an
+    interrupted write leaves a stale store that SegmentStore.open() rejects.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        for d in docs:
+            f.write((json.dumps(d, ensure_ascii=False) + "\n").encode("utf-8"))
+    write_store(path, source=tmp)
+    os.replace(tmp, path)
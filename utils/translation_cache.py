@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+utils/translation_cache.py
+Disk-backed translation cache (SQLite), shared by every worker process on a box.
+
+Entries are keyed by sha256(direction, model, full text), so two texts that share
+a prefix never collide. The table is trimmed back to TRANSLATION_CACHE_MAX_ENTRIES
+by least-recent use (a hit refreshes last_used at most every few minutes, so
+hot entries don't take the write lock on every read). WAL mode + busy timeout
+make concurrent readers/writers safe.
+
+Env:
+  TRANSLATION_CACHE_PATH=Data/translation_cache.sqlite3   ("" or "off" disables)
+  TRANSLATION_CACHE_MAX_ENTRIES=50000
+"""
+
+from __future__ import annotations
+import os, time, sqlite3, hashlib, threading
+from typing import Optional
+
+# -------------------------------
+# Config
+# -------------------------------
+CACHE_PATH = os.getenv("TRANSLATION_CACHE_PATH", os.path.join("Data", "translation_cache.sqlite3"))
+MAX_ENTRIES = int(os.getenv("TRANSLATION_CACHE_MAX_ENTRIES", "50000"))
+_EVICT_EVERY = 200  # check the size bound every N writes
+_TOUCH_AFTER = 300.0  # a hit refreshes last_used only if it is older than this (seconds)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS translations (
+    key        TEXT PRIMARY KEY,
+    direction  TEXT NOT NULL,
+    model      TEXT NOT NULL,
+    value      TEXT NOT NULL,
+    last_used  REAL NOT NULL
+)
+"""
+
+# -------------------------------
+# Connection (one per process, re-opened after fork)
+# -------------------------------
+_conn: Optional[sqlite3.Connection] = None
+_conn_pid: Optional[int] = None
+_lock = threading.Lock()
+_writes = 0
+
+def _enabled() -> bool:
+    return bool(CACHE_PATH) and CACHE_PATH.lower() != "off"
+
+def _connect() -> Optional[sqlite3.Connection]:
+    global _conn, _conn_pid
+    if _conn is not None and _conn_pid == os.getpid():
+        return _conn
+    try:
+        os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=10.0, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(_SCHEMA)
+        conn.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations(last_used)")
+    except sqlite3.Error as e:
+        print(f"⚠️ Translation cache unavailable ({CACHE_PATH}): {e}")
+        return None
+    _conn, _conn_pid = conn, os.getpid()
+    return _conn
+
+def cache_key(direction: str, model: str, text: str) -> str:
+    h = hashlib.sha256()
+    for part in (direction, model, text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+# -------------------------------
+# Public API
+# -------------------------------
+def get_cached(direction: str, model: str, text: str) -> Optional[str]:
+    if not _enabled():
+        return None
+    key = cache_key(direction, model, text)
+    with _lock:
+        conn = _connect()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute("SELECT value, last_used FROM translations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[1] > _TOUCH_AFTER:  # most hits are read-only: no write lock taken
+                conn.execute("UPDATE translations SET last_used = ? WHERE key = ?", (now, key))
+            return row[0]
+        except sqlite3.Error:
+            return None
+
+def put_cached(direction: str, model: str, text: str, value: str) -> None:
+    global _writes
+    if not _enabled():
+        return
+    key = cache_key(direction, model, text)
+    with _lock:
+        conn = _connect()
+        if conn is None:
+            return
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO translations (key, direction, model, value, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, direction, model, value, time.time())
+            )
+            _writes += 1
+            if _writes % _EVICT_EVERY == 0:
+                _evict(conn)
+        except sqlite3.Error:
+            pass
+
+def _evict(conn: sqlite3.Connection) -> None:
+    """Drop least-recently-used rows beyond MAX_ENTRIES."""
+    (count,) = conn.execute("SELECT COUNT(*) FROM translations").fetchone()
+    excess = count - MAX_ENTRIES
+    if excess > 0:
+        conn.execute(
+            "DELETE FROM translations WHERE key IN "
+            "(SELECT key FROM translations ORDER BY last_used ASC LIMIT ?)",
+            (excess,)
+        )
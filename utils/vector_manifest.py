@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+utils/vector_manifest.py
+Incremental, streaming embedding for index builds: only new or changed docs
+reach the backend, and vectors go to disk chunk by chunk.
+
+Next to a build output (e.g. Data/faiss2.index) two files are kept:
+  faiss2.vectors.f32       float32[n, dim]  L2-normalized vectors, raw (np.memmap-able)
+  faiss2.manifest.jsonl    {"model": fingerprint} then one [keyword, sha256(text)] per row
+
+Row i of the manifest describes vector row i. A doc whose (keyword, text hash)
+is listed under the current model fingerprint reuses that row; everything else
+is embedded. Docs that left the corpus are simply not carried over.
+
+A build appends to .tmp copies of both files and commit() swaps them in (the
+old manifest is removed first, so an interrupted swap only costs a full
+re-embed). Checkpoint records how far a build got, so a failed run resumes
+from its last finished chunk instead of starting over.
+"""
+
+from __future__ import annotations
+import os, json, hashlib
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+from utils.embedding import get_embeddings_batch, model_fingerprint
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _row_key(keyword: str, digest: str) -> int:
+    # 64-bit key keeps the lookup table small for large catalogs
+    return int(hashlib.sha256(f"{keyword}\0{digest}".encode("utf-8")).hexdigest()[:16], 16)
+
+def manifest_paths(output_path: str) -> Tuple[str, str]:
+    stem = os.path.splitext(output_path)[0]
+    return stem + ".vectors.f32", stem + ".manifest.jsonl"
+
+def open_vectors(vec_path: str, dim: int) -> np.ndarray:
+    n = os.path.getsize(vec_path) // (4 * dim) if dim else 0
+    if not n:
+        return np.zeros((0, dim), dtype="float32")
+    return np.memmap(vec_path, dtype="float32", mode="r", shape=(n, dim))
+
+class VectorManifest:
+    """Vectors of one build output: lookup into the last build + append-only writer for the next."""
+
+    def __init__(self, output_path: str, full: bool = False):
+        self.vec_path, self.man_path = manifest_paths(output_path)
+        self._lookup: Dict[int, int] = {}
+        self._old = np.zeros((0, 0), dtype="float32")
+        if not full:
+            self._load()
+        self._matched = np.zeros(len(self._old), dtype=bool)
+        self.dim = self._old.shape[1] or None
+        self.rows = 0
+        self.reused = 0
+        self.embedded = 0
+        self._vf = self._mf = None
+
+    def _load(self) -> None:
+        if not (os.path.exists(self.vec_path) and os.path.exists(self.man_path)):
+            return
+        lookup: Dict[int, int] = {}
+        try:
+            with open(self.man_path, "r", encoding="utf-8") as f:
+                header = json.loads(f.readline() or "{}")
+                if header.get("model") != model_fingerprint():
+                    print(f"ℹ️ Embedding model changed ({header.get('model')} → {model_fingerprint()}); "
+                          f"re-embedding all docs.")
+                    return
+                rows = 0
+                for line in f:
+                    keyword, digest = json.loads(line)
+                    lookup.setdefault(_row_key(keyword, digest), rows)
+                    rows += 1
+            old = open_vectors(self.vec_path, int(header.get("dim") or 0))
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable manifest {self.man_path}: {e}")
+            return
+        if len(old) == rows:
+            self._lookup, self._old = lookup, old
+
+    @property
+    def removed(self) -> int:
+        return int(len(self._matched) - self._matched.sum())
+
+    # ---- writing ----
+    def open(self, resume: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Start writing the .tmp files, or continue them from a checkpoint position.
+        Returns False (and starts over) if the files to resume are gone.
+        """
+        if resume and not all(os.path.exists(p + ".tmp") for p in (self.vec_path, self.man_path)):
+            resume = None
+        mode = "r+b" if resume else "wb"
+        self._vf = open(self.vec_path + ".tmp", mode)
+        self._mf = open(self.man_path + ".tmp", mode)
+        if resume:
+            self.rows, self.dim = int(resume["rows"]), resume["dim"]
+            self.reused, self.embedded = int(resume.get("reused", 0)), int(resume.get("embedded", 0))
+            for fh, size in ((self._vf, resume["vec_bytes"]), (self._mf, resume["man_bytes"])):
+                fh.truncate(size)
+                fh.seek(size)
+            self._rematch(resume["man_bytes"])
+        else:
+            self._header()
+        return bool(resume)
+
+    def _rematch(self, man_bytes: int) -> None:
+        """Mark the old rows the resumed part of the build reused, so `removed` counts the whole run."""
+        if not self._lookup:
+            return
+        self._mf.seek(0)
+        self._mf.readline()  # header
+        while self._mf.tell() < man_bytes:
+            keyword, digest = json.loads(self._mf.readline())
+            row = self._lookup.get(_row_key(keyword, digest))
+            if row is not None:
+                self._matched[row] = True
+        self._mf.seek(man_bytes)
+
+    def _header(self) -> None:
+        self._mf.write((json.dumps({"model": model_fingerprint(), "dim": self.dim}) + "\n").encode("utf-8"))
+
+    def position(self) -> Dict[str, Any]:
+        self._vf.flush()
+        self._mf.flush()
+        return {"rows": self.rows, "dim": self.dim, "vec_bytes": self._vf.tell(), "man_bytes": self._mf.tell(),
+                "reused": self.reused, "embedded": self.embedded}
+
+    def add(self, keywords: List[str], texts: List[str], batch_size: int = 128,
+            workers: Optional[int] = None) -> np.ndarray:
+        """Normalized vectors for one chunk (reused where unchanged), appended to the build."""
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype="float32")
+        digests = [text_hash(t) for t in texts]
+        reuse = np.array([self._lookup.get(_row_key(k, d), -1) for k, d in zip(keywords, digests)], dtype="int64")
+        todo = np.flatnonzero(reuse < 0)
+        hit = np.flatnonzero(reuse >= 0)
+        fresh = None
+        if len(todo):
+            fresh = get_embeddings_batch([texts[i] for i in todo], batch_size=batch_size,
+                                         workers=workers, normalize=True)
+
+        if self.dim is None:
+            self.dim = int(fresh.shape[1])
+            # the header was written before the dimension was known
+            self._mf.seek(0)
+            self._mf.truncate()
+            self._header()
+        if not len(hit):
+            vecs = fresh  # nothing reused: the normalized block is the chunk, no copy
+        else:
+            vecs = np.empty((len(texts), self.dim), dtype="float32")
+            vecs[hit] = self._old[reuse[hit]]
+            self._matched[reuse[hit]] = True
+            if len(todo):
+                vecs[todo] = fresh
+
+        self._vf.write(np.ascontiguousarray(vecs).data)
+        self._mf.write("".join(json.dumps([k, d], ensure_ascii=False) + "\n"
+                               for k, d in zip(keywords, digests)).encode("utf-8"))
+        self.rows += len(texts)
+        self.reused += len(hit)
+        self.embedded += len(todo)
+        return vecs
+
+    def commit(self) -> np.ndarray:
+        """Swap the new files in; returns the committed vectors (memory-mapped)."""
+        self._vf.close()
+        self._mf.close()
+        self._old = np.zeros((0, 0), dtype="float32")  # drop the map of the file being replaced
+        if os.path.exists(self.man_path):
+            os.remove(self.man_path)
+        os.replace(self.vec_path + ".tmp", self.vec_path)
+        os.replace(self.man_path + ".tmp", self.man_path)
+        return open_vectors(self.vec_path, self.dim or 0)
+
+# -------------------------------
+# Checkpoint / resume
+# -------------------------------
+class Checkpoint:
+    """
+    Progress of a streaming build, keyed by its inputs. load() returns the saved
+    state only if the source file and the embedding model are unchanged.
+    """
+
+    def __init__(self, output_path: str, source: str):
+        self.path = os.path.splitext(output_path)[0] + ".build.json"
+        st = os.stat(source)
+        self.key = {"source": os.path.abspath(source), "size": st.st_size, "mtime": st.st_mtime,
+                    "model": model_fingerprint()}
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return state if state.get("key") == self.key else None
+
+    def save(self, state: Dict[str, Any]) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({**state, "key": self.key}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)